@@ -0,0 +1,48 @@
+# Parsing entity heavy documents, python benchmarks/entities.py [case] [--compare]
+# --compare also decodes text with one str.replace per html5 entity like replace_symbols did before. That only ever decoded the
+# legacy names, the html5 keys already end in ;, so the trees aren't compared
+import sys, os, time, html.entities
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client.html_parser import HTML
+
+SIZE = 2 * 1024 * 1024
+
+def repeat(unit):
+    return "<html><head><title>benchmark</title></head><body>" + unit * (SIZE // len(unit)) + "</body></html>"
+
+CASES = {
+    # a syntax highlighted code listing, every comparison, generic and string escaped
+    "code": lambda: repeat('<pre>if (a &lt; b &amp;&amp; map.get(&quot;key&quot;) &gt;= 0) {\n    List&lt;String&gt; items = new ArrayList&lt;&gt;();\n    s = &apos;x&apos; + &quot;y&quot;;\n}</pre>\n'),
+    # a math page, greek letters, operators and relations
+    "math": lambda: repeat("<p>&forall;&epsilon; &gt; 0 &exist;&delta;: |x &minus; a| &lt; &delta; &rArr; |f(x) &minus; L| &lt; &epsilon;, &sum;&alpha;&sup2; &le; &int;&phi; &ne; &infin; &isin; &Ropf;</p>\n"),
+    # query strings in links, which attributes have to leave alone when they look like legacy references
+    "links": lambda: repeat('<a href="/search?q=x&amp;page=2&amp;lang=en" title="Tom &amp; Jerry &copy; 2024">Tom &amp; Jerry &mdash; &hellip;</a>\n')
+}
+
+def replace_every_entity(text):
+    for key, value in html.entities.html5.items():
+        text = text.replace(f"&{key};", value)
+    return text
+
+class ReplaceEveryEntityHTML(HTML):
+    def add_text(self, text):
+        self.insert_text(replace_every_entity(text))
+
+def parse(parser, document):
+    start = time.perf_counter()
+    parser.raw_html = document
+    return parser.parse(), time.perf_counter() - start
+
+compare = "--compare" in sys.argv
+names = [name for name in sys.argv[1:] if name != "--compare"] or list(CASES)
+
+for name in names:
+    document = CASES[name]()
+    seconds = parse(HTML(), document)[1]
+    references = document.count("&")
+    print(f"{name} ({len(document) / 1024 / 1024:.1f} MB, {references} references): {seconds:.2f}s, {len(document) / 1024 / 1024 / seconds:.1f} MB/s")
+
+    if compare:
+        every_entity_seconds = parse(ReplaceEveryEntityHTML(), document)[1]
+        print(f"    every entity: {every_entity_seconds:.2f}s, {every_entity_seconds / seconds:.1f}x slower")
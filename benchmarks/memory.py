@@ -0,0 +1,25 @@
+# Bytes per DOM node after parsing and after styling, python benchmarks/memory.py [units]
+import sys, os, tracemalloc
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository)
+
+from http_client.html_parser import HTML, style, walk, get_inline_styles, compile_style_sheet
+
+units = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+unit = "<div class=\"item main\" id=\"i{0}\"><h2>Title {0}</h2><p>Some <b>bold</b> and <a href=\"/x/{0}\">link</a> text &amp; more words here.</p><ul><li>one</li><li>two</li></ul><br></div>\n"
+document = "<html><head><style>p { color: red; }</style></head><body>" + "".join(unit.format(i) for i in range(units)) + "</body></html>"
+
+with open(os.path.join(repository, "assets", "css", "browser.css")) as file:
+    style_sheet = compile_style_sheet(file.read())
+
+tracemalloc.start()
+start = tracemalloc.get_traced_memory()[0]
+
+tree = HTML(document).parse()
+parsed = tracemalloc.get_traced_memory()[0]
+
+style(tree, style_sheet.merge(get_inline_styles(tree)))
+styled = tracemalloc.get_traced_memory()[0]
+
+nodes = sum(1 for _ in walk(tree))
+print(f"{nodes} nodes: parsed {(parsed - start) / nodes:.0f} bytes/node, styled {(styled - start) / nodes:.0f} bytes/node")
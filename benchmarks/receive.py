@@ -0,0 +1,46 @@
+# Receive throughput from a loopback server, python benchmarks/receive.py [sizes in MB]
+import sys, os, time, socket, threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client.connection import HTTPClient
+from http_client.engine import network_engine
+from utils.constants import DEFAULT_HEADERS
+
+sizes = [int(size) for size in sys.argv[1:]] or [1, 10, 50]
+line = "<p>café " + "x" * 90 + "</p>\n" # the é is two bytes, so some of them get split between reads
+bodies = {size: (line * (size * 1024 * 1024 // len(line.encode()))).encode() for size in sizes}
+
+def handle(client_socket):
+    reader = client_socket.makefile("rb")
+    while True:
+        request_line = reader.readline()
+        if not request_line:
+            return
+        while reader.readline() not in (b"\r\n", b""):
+            pass
+
+        body = bodies[int(request_line.split()[1].decode().strip("/").split("_")[0])]
+        client_socket.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\nCache-Control: no-store\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+
+def serve(server_socket):
+    while True:
+        client_socket, _ = server_socket.accept()
+        threading.Thread(target=handle, args=(client_socket,), daemon=True).start()
+
+server_socket = socket.socket()
+server_socket.bind(("127.0.0.1", 0))
+server_socket.listen()
+threading.Thread(target=serve, args=(server_socket,), daemon=True).start()
+port = server_socket.getsockname()[1]
+
+for size in sizes:
+    expected = bodies[size].decode()
+    client = HTTPClient()
+
+    # only the load, without a document stream nothing is parsed while the body arrives. A unique path keeps caches out of it
+    start = time.perf_counter()
+    network_engine.submit(client.load(f"http://127.0.0.1:{port}/{size}_{time.time()}", DEFAULT_HEADERS)).result()
+    elapsed = time.perf_counter() - start
+
+    assert client.content_response == expected, "body was not decoded correctly"
+    print(f"{size:3d} MB: {len(bodies[size]) / elapsed / 1024 / 1024:7.1f} MB/s")
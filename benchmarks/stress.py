@@ -0,0 +1,44 @@
+# Tree walks on a 10k deep and a 1M wide document, none of them may hit the recursion limit. python benchmarks/stress.py
+import sys, os, time
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repository)
+
+import arcade
+
+from http_client.html_parser import HTML, style, walk, compile_style_sheet
+from http_client.dom_cache import encode_tree, decode_tree
+
+with open(os.path.join(repository, "assets", "css", "browser.css")) as file:
+    style_sheet = compile_style_sheet(file.read())
+
+try: # layout measures text, so it needs a window
+    window = arcade.Window(800, 600, visible=False)
+except Exception as e:
+    window = None
+    print(f"No window ({type(e).__name__}), layout is skipped")
+
+def measure(name, step, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{name} {step}: {time.perf_counter() - start:.2f}s")
+    return result
+
+# laying out a million paragraphs takes minutes, only the deep tree is laid out
+for name, document, measure_layout in [("10k deep", "<div>" * 10000 + "x" + "</div>" * 10000, True), ("1M wide", "<p>x</p>" * 1000000, False)]:
+    tree = measure(name, "parse", lambda: HTML(document).parse())
+    nodes = measure(name, "walk", lambda: sum(1 for _ in walk(tree)))
+    measure(name, "style", lambda: style(tree, style_sheet))
+    measure(name, "to/from json", lambda: HTML.from_json(HTML.to_json(tree)))
+    measure(name, "dom cache round trip", lambda: decode_tree(encode_tree(tree)))
+
+    if window is not None and measure_layout:
+        from http_client.renderer import DocumentLayout, layout_tree, paint_tree
+
+        def layout_and_paint():
+            document_layout = DocumentLayout(tree)
+            layout_tree(document_layout)
+            paint_tree(document_layout, [])
+
+        measure(name, "layout+paint", layout_and_paint)
+
+    print(f"{name}: {nodes} nodes")
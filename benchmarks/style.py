@@ -0,0 +1,69 @@
+# Style recalc against large generated stylesheets, python benchmarks/style.py [case] [--compare]
+# --compare also styles with every rule tested against every node and checks the computed styles are identical
+import sys, os, time, random
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client.html_parser import HTML, CSSParser, CompiledStyleSheet, style, style_node, walk
+
+def tags_case():
+    # 5k rules over 500 tag names, 40% of them descendant selectors, and a 14k node page
+    tags = ["div", "p", "span", "a", "li", "ul", "h1", "h2", "b", "i", "em", "section", "article", "nav", "header", "footer", "td", "tr", "table", "img"] + [f"x-tag{i}" for i in range(480)]
+    css = "\n".join(
+        (random.choice(tags) if random.random() < 0.6 else f"{random.choice(tags)} {random.choice(tags)}") + " { color: red; margin: 1px; }"
+        for _ in range(5000)
+    )
+    body = "<div><p>text <b>bold</b> <a href=x>l</a></p><ul><li>a</li><li>b</li></ul><span>s</span></div>" * 1000
+    return [("14k nodes x 5k rules", f"<html><body>{body}</body></html>", css)]
+
+def descendant_case():
+    # 2k "X Y" descendant rules, on long nesting chains where walking the parents is expensive and on a mostly shallow page
+    tags = ["div", "p", "span", "a", "li", "ul", "b", "section", "article", "nav"] + [f"x-tag{i}" for i in range(200)]
+    css = "\n".join(f"{random.choice(tags)} {random.choice(['p', 'span', 'a', 'b', 'li'])} {{ color: red; }}" for _ in range(2000))
+    leaves = "<p>t <b>b</b> <a>l</a> <span>s</span></p>" * 20
+    chain = "<div>" * 100 + leaves + "</div>" * 100
+    section = "<section><ul><li>x</li></ul>" + leaves + "</section>"
+    return [
+        ("50 chains 100 deep", f"<html><body>{chain * 50}{section * 100}</body></html>", css),
+        ("mostly shallow", f"<html><body>{chain}{section * 200}</body></html>", css)
+    ]
+
+def selectors_case():
+    # class, id, compound and child rules against 2000 divs with classes and ids, the time should stay flat as the sheet grows
+    body = "".join(f'<div class="c{random.randrange(2000)} box" id="d{i}"><p class="c{random.randrange(2000)}">text <span>x</span></p></div>' for i in range(2000))
+    cases = []
+    for count in (1000, 5000, 20000):
+        css = "\n".join(random.choice([f".c{i} {{ color: red; }}", f"#d{i} {{ color: blue; }}", f"div.c{i} p {{ color: green; }}", f".c{i} > p {{ color: pink; }}"]) for i in range(count))
+        cases.append((f"{count} rules", f"<html><body>{body}</body></html>", css))
+    return cases
+
+CASES = {"tags": tags_case, "descendant": descendant_case, "selectors": selectors_case}
+
+def style_every_rule(tree, style_sheet):
+    # what style() did before the rule index
+    computed_styles = {}
+    for node in walk(tree):
+        style_node(node, style_sheet.rules, computed_styles)
+
+def computed_styles(tree):
+    return [dict(node.style) for node in walk(tree)]
+
+compare = "--compare" in sys.argv
+names = [name for name in sys.argv[1:] if name != "--compare"] or list(CASES)
+
+for name in names:
+    random.seed(1)
+    for label, document, css in CASES[name]():
+        tree = HTML(document).parse()
+        style_sheet = CompiledStyleSheet(CSSParser(css).parse())
+        nodes = sum(1 for _ in walk(tree))
+
+        start = time.perf_counter()
+        style(tree, style_sheet)
+        print(f"{name}, {label} ({nodes} nodes, {len(style_sheet.rules)} rules): {time.perf_counter() - start:.2f}s")
+
+        if compare:
+            indexed = computed_styles(tree)
+            start = time.perf_counter()
+            style_every_rule(tree, style_sheet)
+            print(f"    every rule: {time.perf_counter() - start:.2f}s")
+            assert computed_styles(tree) == indexed, "computed styles differ"
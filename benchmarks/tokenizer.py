@@ -0,0 +1,70 @@
+# HTML tokenizer throughput on ~5 MB generated documents, python benchmarks/tokenizer.py [case] [--compare]
+# --compare also tokenizes one character at a time like feed() did before the split/find scanner and checks the trees are identical
+import sys, os, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client.html_parser import HTML, walk
+
+SIZE = 5 * 1024 * 1024
+CHUNK_SIZE = 16 * 1024 # roughly what a socket read hands the document stream
+
+def repeat(unit):
+    return "<html><head><title>benchmark</title></head><body>" + unit * (SIZE // len(unit)) + "</body></html>"
+
+CASES = {
+    "markup": lambda: repeat('<div class="item main" id="i"><h2>Title</h2><p>Some <b>bold</b> and <a href="/x/y">link</a> text &amp; more words here.</p><ul><li>one</li><li>two</li></ul></div>\n'),
+    "text": lambda: repeat("<p>" + "A long paragraph of plain prose with barely any markup in it, the way articles look. " * 20 + "</p>\n"),
+    "attributes": lambda: repeat('<a href="/search?q=1&amp;page=2" class="result link" data-id="12345" title="a title"><img src="/i.png" alt="x" width=16 height=16></a>\n')
+}
+
+class PerCharacterHTML(HTML):
+    def feed(self, raw_html):
+        text = self.text
+        for c in raw_html:
+            if c == "<":
+                if text:
+                    self.add_text(text)
+                text = ""
+            elif c == ">":
+                self.add_tag(text)
+                text = ""
+            else:
+                text += c
+        self.text = text
+
+    def close(self):
+        if self.text:
+            self.add_text(self.text)
+        return self.finish()
+
+def parse(parser, document, chunk_size=None):
+    start = time.perf_counter()
+    if chunk_size:
+        for position in range(0, len(document), chunk_size):
+            parser.feed(document[position:position + chunk_size])
+        tree = parser.close()
+    else:
+        parser.raw_html = document
+        tree = parser.parse()
+    return tree, time.perf_counter() - start
+
+def report(label, document, seconds):
+    print(f"    {label}: {seconds:.2f}s, {len(document) / 1024 / 1024 / seconds:.1f} MB/s")
+
+compare = "--compare" in sys.argv
+names = [name for name in sys.argv[1:] if name != "--compare"] or list(CASES)
+
+for name in names:
+    document = CASES[name]()
+    tree, seconds = parse(HTML(), document)
+    print(f"{name} ({len(document) / 1024 / 1024:.1f} MB, {sum(1 for _ in walk(tree))} nodes)")
+    report("whole", document, seconds)
+    report(f"{CHUNK_SIZE // 1024} KB chunks", document, parse(HTML(), document, CHUNK_SIZE)[1])
+
+    if compare:
+        parser = PerCharacterHTML()
+        parser.text = ""
+        per_character_tree, per_character_seconds = parse(parser, document)
+        report("per character", document, per_character_seconds)
+        print(f"    speedup: {per_character_seconds / seconds:.1f}x")
+        assert HTML.to_json(per_character_tree) == HTML.to_json(tree), "trees differ"
@@ -0,0 +1,363 @@
+import sqlite3, threading, zlib, time, hashlib, logging, ujson
+
+from email.utils import parsedate_to_datetime
+
+CACHE_DATABASE = "cache.db"
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+EVICTION_BATCH = 32
+HTTP_CACHE_FORMAT_VERSION = 2 # part of the key, bump it when the stored entry layout changes
+
+CACHEABLE_STATUSES = ["200", "203"]
+PERMANENT_REDIRECT_STATUSES = ["301", "308"]
+HEURISTIC_FRESHNESS_FRACTION = 0.1 # RFC 9111 4.2.2, 10% of the time since Last-Modified
+HEURISTIC_FRESHNESS_MAX = 24 * 60 * 60
+
+# headers a 304 must not overwrite in the stored response
+NOT_UPDATED_ON_304 = ["content-length", "content-encoding", "transfer-encoding", "content-type"]
+
+def parse_http_date(value):
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+def parse_cache_control(value):
+    directives = {}
+    for directive in value.split(","):
+        name, _, argument = directive.partition("=")
+        name = name.strip().casefold()
+        if name:
+            directives[name] = argument.strip().strip('"')
+    return directives
+
+class CacheEntry():
+    def __init__(self, url, status, explanation, http_version, headers, content, vary, request_time, response_time):
+        self.url = url
+        self.status = status
+        self.explanation = explanation
+        self.http_version = http_version
+        self.headers = headers
+        self.content = content
+        self.vary = vary
+        self.request_time = request_time
+        self.response_time = response_time
+
+    def cache_control(self):
+        return parse_cache_control(self.headers.get("cache-control", ""))
+
+    def freshness_lifetime(self):
+        cache_control = self.cache_control()
+
+        if "max-age" in cache_control:
+            try:
+                return int(cache_control["max-age"])
+            except ValueError:
+                return 0
+
+        date = parse_http_date(self.headers.get("date")) or self.response_time
+
+        if "expires" in self.headers:
+            expires = parse_http_date(self.headers["expires"])
+            return expires - date if expires is not None else 0 # invalid Expires values like "0" mean already expired
+
+        last_modified = parse_http_date(self.headers.get("last-modified"))
+        if last_modified is not None and date > last_modified:
+            return min((date - last_modified) * HEURISTIC_FRESHNESS_FRACTION, HEURISTIC_FRESHNESS_MAX)
+
+        return 0
+
+    def current_age(self):
+        date = parse_http_date(self.headers.get("date")) or self.response_time
+        apparent_age = max(0, self.response_time - date)
+
+        try:
+            age_value = int(self.headers.get("age", 0))
+        except ValueError:
+            age_value = 0
+
+        corrected_initial_age = max(apparent_age, age_value + (self.response_time - self.request_time))
+        return corrected_initial_age + (time.time() - self.response_time)
+
+    def is_fresh(self):
+        if "no-cache" in self.cache_control():
+            return False
+
+        return self.freshness_lifetime() > self.current_age()
+
+    def validators(self):
+        validators = {}
+        if "etag" in self.headers:
+            validators["If-None-Match"] = self.headers["etag"]
+        if "last-modified" in self.headers:
+            validators["If-Modified-Since"] = self.headers["last-modified"]
+        return validators
+
+    def matches_vary(self, request_headers):
+        request_headers = {name.casefold(): value for name, value in request_headers.items()}
+        return all(request_headers.get(name) == value for name, value in self.vary.items())
+
+    def to_json(self):
+        return {
+            "url": self.url,
+            "status": self.status,
+            "explanation": self.explanation,
+            "http_version": self.http_version,
+            "headers": self.headers,
+            "content": self.content,
+            "vary": self.vary,
+            "request_time": self.request_time,
+            "response_time": self.response_time
+        }
+
+    @classmethod
+    def from_json(cls, json_dict):
+        return cls(**json_dict)
+
+class CacheStore():
+    # Single SQLite file indexed by key, with a byte budget enforced by evicting the least recently used entries
+    def __init__(self, path=CACHE_DATABASE, max_size=DEFAULT_CACHE_SIZE, compress=True):
+        self.path = path
+        self.max_size = max_size
+        self.compress = compress
+        self.lock = threading.Lock()
+        self.database = None # opened on first use, so importing doesn't touch the disk
+
+        self.total_size = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def get_database(self):
+        if self.database is None:
+            self.database = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.database.execute("PRAGMA journal_mode=WAL")
+            self.database.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, data BLOB NOT NULL, compressed INTEGER NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)")
+            self.database.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self.total_size = self.database.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        return self.database
+
+    def configure(self, max_size, compress):
+        with self.lock:
+            self.max_size = max_size
+            self.compress = compress
+            self.evict()
+
+    def get(self, key):
+        with self.lock:
+            database = self.get_database()
+            row = database.execute("SELECT data, compressed FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            database.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+
+        data, compressed = row
+        return zlib.decompress(data) if compressed else data
+
+    def contains(self, key):
+        with self.lock:
+            return self.get_database().execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, data):
+        compressed = False
+        if self.compress:
+            compressed_data = zlib.compress(data)
+            if len(compressed_data) < len(data):
+                data, compressed = compressed_data, True
+
+        with self.lock:
+            database = self.get_database()
+            row = database.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                self.total_size -= row[0]
+
+            database.execute("INSERT OR REPLACE INTO entries (key, data, compressed, size, last_access) VALUES (?, ?, ?, ?, ?)", (key, data, int(compressed), len(data), time.time()))
+            self.total_size += len(data)
+
+            self.evict()
+
+    def delete(self, key):
+        with self.lock:
+            database = self.get_database()
+            row = database.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if row:
+                database.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.total_size -= row[0]
+
+    def evict(self):
+        database = self.get_database()
+        while self.total_size > self.max_size:
+            rows = database.execute("SELECT key, size FROM entries ORDER BY last_access LIMIT ?", (EVICTION_BATCH,)).fetchall()
+            if not rows:
+                break
+
+            for key, size in rows:
+                if self.total_size <= self.max_size:
+                    break
+
+                database.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self.total_size -= size
+                self.evictions += 1
+                self.evicted_bytes += size
+
+    def stats(self):
+        with self.lock:
+            entries = self.get_database().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {
+                "entries": entries,
+                "size": self.total_size,
+                "max_size": self.max_size,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes
+            }
+
+cache_store = CacheStore()
+
+class HTTPCache():
+    def __init__(self, cache_store):
+        self.cache_store = cache_store
+
+        self.lookups = 0
+        self.hits = 0
+        self.revalidations = 0
+        self.bytes_saved = 0
+
+    def get_key(self, url):
+        return f"http:{HTTP_CACHE_FORMAT_VERSION}:{hashlib.sha256(url.encode()).hexdigest()}"
+
+    def lookup(self, url, request_headers):
+        self.lookups += 1
+
+        data = self.cache_store.get(self.get_key(url))
+        if data is None:
+            return None
+
+        try:
+            metadata, _, content = data.partition(b"\n")
+            entry = CacheEntry.from_json({**ujson.loads(metadata), "content": content.decode("utf-8", "surrogatepass")})
+        except (ValueError, TypeError) as e:
+            logging.debug(f"Dropping unreadable cache entry for {url}: {e}")
+            self.remove(url)
+            return None
+
+        if entry.url != url or not entry.matches_vary(request_headers):
+            return None
+
+        return entry
+
+    def count_hit(self, entry, revalidated=False):
+        if revalidated:
+            self.revalidations += 1
+        else:
+            self.hits += 1
+
+        self.bytes_saved += len(entry.content.encode())
+
+    def is_storable(self, status, headers):
+        if status not in CACHEABLE_STATUSES:
+            return False
+
+        if "no-store" in parse_cache_control(headers.get("cache-control", "")):
+            return False
+
+        return headers.get("vary", "").strip() != "*"
+
+    def store(self, url, request_headers, status, explanation, http_version, headers, content, request_time, response_time):
+        if not self.is_storable(status, headers):
+            self.remove(url)
+            return None
+
+        request_headers = {name.casefold(): value for name, value in request_headers.items()}
+        vary = {
+            name.strip().casefold(): request_headers.get(name.strip().casefold())
+            for name in headers.get("vary", "").split(",")
+            if name.strip()
+        }
+
+        entry = CacheEntry(url, status, explanation, http_version, headers, content, vary, request_time, response_time)
+        if entry.freshness_lifetime() <= 0 and not entry.validators(): # it could never be served again
+            self.remove(url)
+            return None
+
+        self.write(entry)
+        return entry
+
+    def freshen(self, entry, headers, request_time, response_time):
+        # a 304 carries updated metadata for the stored response
+        for name, value in headers.items():
+            if name not in NOT_UPDATED_ON_304:
+                entry.headers[name] = value
+
+        entry.request_time = request_time
+        entry.response_time = response_time
+
+        if self.is_storable(entry.status, entry.headers):
+            self.write(entry)
+        else:
+            self.remove(entry.url)
+
+    def write(self, entry):
+        # JSON metadata on the first line, then the body as is. ujson holds the GIL, so a big body must not go through it
+        metadata = entry.to_json()
+        content = metadata.pop("content")
+        self.cache_store.put(self.get_key(entry.url), ujson.dumps(metadata).encode() + b"\n" + content.encode("utf-8", "surrogatepass"))
+
+    def remove(self, url):
+        self.cache_store.delete(self.get_key(url))
+
+    def stats(self):
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "revalidations": self.revalidations,
+            "bytes_saved": self.bytes_saved,
+            **self.cache_store.stats()
+        }
+
+http_cache = HTTPCache(cache_store)
+
+class RedirectCache():
+    # Remembers permanent (and explicitly cacheable) redirects so the extra round trip is only paid once
+    def __init__(self, cache_store):
+        self.cache_store = cache_store
+        self.hits = 0
+
+    def get_key(self, url):
+        return f"redirect:{hashlib.sha256(url.encode()).hexdigest()}"
+
+    def lookup(self, url):
+        data = self.cache_store.get(self.get_key(url))
+        if data is None:
+            return None
+
+        redirect = ujson.loads(data)
+        if redirect["url"] != url:
+            return None
+
+        if redirect["expires"] is not None and redirect["expires"] <= time.time():
+            self.cache_store.delete(self.get_key(url))
+            return None
+
+        self.hits += 1
+        return redirect["location"]
+
+    def store(self, url, status, headers, location):
+        cache_control = parse_cache_control(headers.get("cache-control", ""))
+        response_time = time.time()
+
+        if "no-store" in cache_control or "no-cache" in cache_control:
+            expires = 0
+        elif "max-age" in cache_control or "expires" in headers:
+            entry = CacheEntry(url, status, None, None, headers, "", {}, response_time, response_time)
+            expires = response_time + entry.freshness_lifetime() - entry.current_age()
+        elif status in PERMANENT_REDIRECT_STATUSES:
+            expires = None
+        else:
+            expires = 0
+
+        if expires is not None and expires <= response_time:
+            self.cache_store.delete(self.get_key(url))
+            return
+
+        self.cache_store.put(self.get_key(url), ujson.dumps({"url": url, "location": location, "status": status, "expires": expires}).encode())
+
+redirect_cache = RedirectCache(cache_store)
@@ -1,6 +1,30 @@
-import socket, logging, ssl, threading, os, ujson, time
-
-from http_client.html_parser import HTML, CSSParser, Element, tree_to_list, get_inline_styles
+import asyncio, logging, ssl, ujson, zlib, time, hashlib, threading
+
+from types import MappingProxyType
+
+from http_client.html_parser import HTML, CSSParser, Element, PreloadScanner, walk, get_inline_styles, is_stylesheet_link
+from http_client.pool import connection_pool
+from http_client.engine import network_engine
+from http_client.cache import http_cache, redirect_cache, cache_store
+from http_client.dom_cache import dom_cache
+from http_client.scheduler import scheduler, make_request, Response, PRIORITY_DOCUMENT, PRIORITY_STYLESHEET
+from http_client.decoders import ChunkedDecoder, ContentDecoder, get_text_decoder, SUPPORTED_CONTENT_ENCODINGS
+
+READ_SIZE_MIN = 16 * 1024
+READ_SIZE_MAX = 256 * 1024
+MAX_REDIRECTS = 4
+READ_TIMEOUT = 15 # seconds without any data before a response is given up on
+TOTAL_TIMEOUT = 60 # seconds for a whole load, redirects included
+
+FIRST_PAINT_TEXT = 1024 # characters of body text before a partial document is worth painting
+REPAINT_GROWTH = 2 # repaint a loading document each time its content doubles, so a huge page is laid out O(log n) times
+CSS_CACHE_VERSION = 2 # part of the parsed stylesheet key, bump it when the parser or the selector JSON changes
+
+STYLESHEET_HEADERS = {
+    "Accept": "text/css,*/*;q=0.1",
+    "Sec-Fetch-Dest": "style",
+    "Sec-Fetch-Mode": "no-cors"
+}
 
 def resolve_url(scheme, host, port, path, url):
     if "://" in url: return url
@@ -17,6 +41,41 @@ def resolve_url(scheme, host, port, path, url):
     else:
         return f"{scheme}://{host}:{port}{url}"
 
+async def fetch(request):
+    # Loads the request on a throwaway HTTPClient so nothing is shared with the caller
+    client = HTTPClient()
+    client.priority = request.priority
+    client.tab = request.tab
+
+    if not await client.load(request.url, request.headers):
+        return None
+
+    return Response(client.get_url(), client.response_status, client.response_explanation, client.response_http_version, MappingProxyType(client.response_headers), client.content_response)
+
+async def load_stylesheet(url, request_headers, tab, priority=PRIORITY_STYLESHEET):
+    try:
+        response = await fetch(make_request(url, {**request_headers, **STYLESHEET_HEADERS}, priority, tab))
+    except Exception as e:
+        logging.error(f"Error fetching stylesheet {url}: {e}")
+        return []
+
+    content = response.content if response else ""
+
+    # the HTTP cache decides whether the text is still valid, parsed rules are keyed by the text itself
+    css_cache_key = f"css:{CSS_CACHE_VERSION}:{hashlib.sha256(content.encode()).hexdigest()}"
+
+    # SQLite, (de)compression and JSON are all CPU or disk work, none of it runs on the event loop
+    loop = asyncio.get_running_loop()
+    cached_rules = await loop.run_in_executor(None, cache_store.get, css_cache_key)
+    if cached_rules is not None:
+        return await loop.run_in_executor(None, lambda: CSSParser.from_json(ujson.loads(cached_rules)))
+
+    rules = await loop.run_in_executor(None, lambda: CSSParser(content).parse())
+
+    await loop.run_in_executor(None, lambda: cache_store.put(css_cache_key, ujson.dumps(CSSParser.to_json(rules)).encode()))
+
+    return rules
+
 class HTTPClient():
     def __init__(self):
         self.scheme = "http"
@@ -32,20 +91,22 @@ class HTTPClient():
         self.css_rules = []
         self.content_response = ""
         self.view_source = False
-        self.redirect_count = 0
         self.needs_render = False
+        self.connection = None
+        self.navigation = None
+        self.extra_headers = None
+        self.document_stream = None
+        self.stylesheet_tasks = {}
+        self.tree_lock = threading.Lock() # held while the parser grows the tree and while the renderer reads it
+        self.priority = PRIORITY_DOCUMENT
+        self.scheduled_request = None # what perform_exchange is waiting on the scheduler with
+        self.tab = self # whose request this is, the scheduler round robins between tabs
 
     def file_request(self, url):
         with open(url.split("file://", 1)[1], "r") as file:
             self.content_response = file.read()
 
-    def get_request(self, url, request_headers, css=False):
-        if url.startswith("view-source:"):
-            url = url.split("view-source:")[1]
-            self.view_source = True
-        else:
-            self.view_source = False
-
+    def open_url(self, url, request_headers):
         self.scheme, url_parts = url.split("://", 1)
 
         if "/" not in url_parts:
@@ -61,104 +122,260 @@ class HTTPClient():
         else:
             self.port = 80 if self.scheme == "http" else 443
 
-        self.request_headers = request_headers
+        self.request_headers = dict(request_headers)
         self.response_explanation = None
         self.response_headers = {}
         self.response_http_version = None
         self.response_status = None
         self.content_response = ""
-        
-        if "Host" not in self.request_headers:
-            self.request_headers["Host"] = self.host
 
-        cache_filename = f"{self.scheme}_{self.host}_{self.port}_{self.path.replace('/', '_')}.html"
-        if os.path.exists(f"html_cache/{cache_filename}"):
-            threading.Thread(target=self.parse, daemon=True).start()
+        self.request_headers["Host"] = self.host if self.port in [80, 443] else f"{self.host}:{self.port}"
+        self.request_headers["Connection"] = "keep-alive"
+        self.request_headers["Accept-Encoding"] = SUPPORTED_CONTENT_ENCODINGS
+
+    def get_request(self, url, request_headers):
+        # returns right away, the document is loaded on the network engine and needs_render is set once it's ready
+        self.cancel()
+        self.navigation = network_engine.submit(self.navigate(url, request_headers))
+        return self.navigation
+
+    def cancel(self):
+        # the navigation future is the tab's cancellation token, cancelling it stops every await in the load
+        if self.navigation and not self.navigation.done():
+            self.navigation.cancel()
+        self.navigation = None
+
+    async def navigate(self, url, request_headers):
+        self.view_source = url.startswith("view-source:")
+        if self.view_source:
+            url = url.split("view-source:", 1)[1]
+
+        self.stylesheet_tasks = {}
+        self.document_stream = DocumentStream(self)
+
+        try:
+            if not await self.load(url, request_headers):
+                return
+
+            await self.parse()
+        except ssl.SSLCertVerificationError:
+            logging.debug(f"Invalid SSL cert for {self.host}:{self.port}{self.path}")
+        except TimeoutError:
+            logging.debug(f"Timed out loading {url}")
+        except asyncio.CancelledError:
+            for task in self.stylesheet_tasks.values():
+                task.cancel()
+            self.document_stream.cancel()
+            raise
+
+    async def load(self, url, request_headers):
+        async with asyncio.timeout(TOTAL_TIMEOUT):
+            return await self.follow_redirects(url, request_headers)
+
+    async def follow_redirects(self, url, request_headers):
+        loop = asyncio.get_running_loop()
+        visited_urls = set()
+
+        for _ in range(MAX_REDIRECTS + 1):
+            self.open_url(url, request_headers)
+            url = self.get_url()
+
+            if url in visited_urls:
+                logging.debug(f"Redirect loop detected at {url}")
+                return False
+            visited_urls.add(url)
+
+            # known redirects are followed before any socket is opened
+            location = await loop.run_in_executor(None, redirect_cache.lookup, url)
+            if location:
+                logging.debug(f"Following cached redirect from {url} to {location}")
+                url = location
+                continue
+
+            await self.exchange()
+
+            if not (300 <= int(self.response_status) < 400 and "location" in self.response_headers):
+                return True
+
+            location = resolve_url(self.scheme, self.host, self.port, self.path, self.response_headers["location"])
+            await loop.run_in_executor(None, redirect_cache.store, url, self.response_status, self.response_headers, location)
+            url = location
+
+        logging.debug(f"Too many redirects for {url}")
+        return False
+
+    def get_url(self):
+        return f"{self.scheme}://{self.host}:{self.port}{self.path}"
+
+    async def exchange(self):
+        await exchange_coalescer.exchange(self)
+
+    async def perform_exchange(self):
+        # the cache reads and writes whole bodies through SQLite, zlib and JSON, so they run in the executor like the DOM cache
+        loop = asyncio.get_running_loop()
+        url = self.get_url()
+        cache_entry = await loop.run_in_executor(None, http_cache.lookup, url, self.request_headers)
+
+        if cache_entry and cache_entry.is_fresh():
+            logging.debug(f"Serving {url} from the HTTP cache")
+            await loop.run_in_executor(None, http_cache.count_hit, cache_entry)
+            self.use_cache_entry(cache_entry)
             return
-        
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect((self.host, self.port))
 
-        if self.scheme == "https":
-            ctx = ssl.create_default_context()
+        # only requests that really go to the network wait for the scheduler, cache hits and coalesced requests don't
+        self.scheduled_request = make_request(url, self.request_headers, self.priority, self.tab)
+        async with scheduler.slot(self.scheduled_request):
+            request_time = time.time()
             try:
-                self.socket = ctx.wrap_socket(self.socket, server_hostname=self.host)
-            except ssl.SSLCertVerificationError:
-                logging.debug(f"Invalid SSL cert for {self.host}:{self.port}{self.path}")
-                return
+                await self.send_request(cache_entry.validators() if cache_entry else None)
+                await self.read_response()
+            except BaseException:
+                if self.connection: # cancelled or timed out halfway through, the connection is in an unknown state
+                    await connection_pool.release(self.connection, reusable=False)
+                    self.connection = None
+                raise
+            response_time = time.time()
+
+        if cache_entry and self.response_status == "304":
+            logging.debug(f"Revalidated {url}, serving the cached body")
+            await loop.run_in_executor(None, http_cache.freshen, cache_entry, self.response_headers, request_time, response_time)
+            await loop.run_in_executor(None, http_cache.count_hit, cache_entry, True)
+            self.use_cache_entry(cache_entry)
+        else:
+            await loop.run_in_executor(None, http_cache.store, url, self.request_headers, self.response_status, self.response_explanation, self.response_http_version, self.response_headers, self.content_response, request_time, response_time)
+
+    def copy_response(self, client):
+        self.response_status = client.response_status
+        self.response_explanation = client.response_explanation
+        self.response_http_version = client.response_http_version
+        self.response_headers = dict(client.response_headers)
+        self.content_response = client.content_response
+
+    def use_cache_entry(self, cache_entry):
+        self.response_status = cache_entry.status
+        self.response_explanation = cache_entry.explanation
+        self.response_http_version = cache_entry.http_version
+        self.response_headers = dict(cache_entry.headers)
+        self.content_response = cache_entry.content # nothing was streamed, parse() looks for the tree in the DOM cache first
+
+    async def send_request(self, extra_headers=None):
+        self.connection = await connection_pool.acquire(self.scheme, self.host, self.port)
+        self.extra_headers = extra_headers # kept so a retry on a dead keep-alive connection sends the same request
+
+        request_headers = {**self.request_headers, **(extra_headers or {})}
+        request_header_lines = '\r\n'.join([f"{header_name}: {header_value}" for header_name, header_value in request_headers.items()])
+        request = f"GET {self.path} HTTP/1.1\r\n{request_header_lines}\r\n\r\n"
 
-        request_header_lines = '\r\n'.join([f"{header_name}: {header_value}" for header_name, header_value in self.request_headers.items()])
-        request = f"GET {self.path} HTTP/1.0\r\n{request_header_lines}\r\n\r\n"
-        
         logging.debug(f"Sending Request:\n{request}")
 
-        self.socket.send(request.encode())
+        try:
+            self.connection.writer.write(request.encode())
+            await self.connection.writer.drain()
+        except OSError:
+            connection = self.connection
+            self.connection = None
+            await connection_pool.release(connection, reusable=False)
+            if not connection.reused:
+                raise
+
+            # the server closed the keep-alive connection between our stale check and the send, try once on a new one
+            await self.send_request(extra_headers)
+
+    async def read_response(self):
+        read_size = READ_SIZE_MIN
+
+        text_parts = []
+        content_length = None
+        body_received = 0
+        chunked_decoder = None
+        content_decoder = None
+        text_decoder = None
+        reusable = False
 
-        threading.Thread(target=self.receive_response, daemon=True, args=(css,)).start()
+        try:
+            async with asyncio.timeout(READ_TIMEOUT):
+                header_data = await self.connection.reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as e:
+            if self.connection.reused and isinstance(e, asyncio.IncompleteReadError) and not e.partial:
+                logging.debug("Reused connection was closed by peer, retrying on a new connection.")
+                await connection_pool.release(self.connection, reusable=False)
+                self.connection = None # released, so a failing retry must not release it again
+                await self.send_request(self.extra_headers)
+                return await self.read_response()
+
+            await connection_pool.release(self.connection, reusable=False)
+            self.connection = None
+            raise
+
+        self._parse_headers(header_data[:-4].decode('latin-1')) # -4 for the \r\n\r\n
+
+        if self.response_headers.get("transfer-encoding", "").casefold().endswith("chunked"):
+            chunked_decoder = ChunkedDecoder()
+
+        content_decoder = ContentDecoder(self.response_headers.get("content-encoding", ""))
+        text_decoder = get_text_decoder(self.response_headers.get("content-type", ""))
+
+        document_stream = self.document_stream if 200 <= int(self.response_status) < 300 else None
+
+        content_length_header = self.response_headers.get("content-length")
+        if self.response_status in ["204", "304"]:
+            content_length = 0
+        elif content_length_header and not chunked_decoder:
+            try:
+                content_length = int(content_length_header)
+            except ValueError:
+                logging.debug(f"Invalid Content-Length header: {content_length_header}")
 
-    def receive_response(self, css=False):
-        buffer = b""
-        headers_parsed = False
-        content_length = None
-        
-        while True:
+        while not reusable:
             try:
-                data = self.socket.recv(2048)
+                if content_length is not None and body_received >= content_length:
+                    reusable = True
+                    break
+
+                async with asyncio.timeout(READ_TIMEOUT):
+                    if content_length is not None:
+                        data = await self.connection.reader.read(min(read_size, content_length - body_received))
+                    else:
+                        data = await self.connection.reader.read(read_size)
+
                 if not data:
                     logging.debug("Connection closed by peer.")
                     break
-                buffer += data
-
-                if not headers_parsed:
-                    header_end_index = buffer.find(b"\r\n\r\n")
-                    if header_end_index != -1: # not found
-                        header_data = buffer[:header_end_index].decode('latin-1')
-                        body_data = buffer[header_end_index + 4:] # +4 for the \r\n\r\n
-                        
-                        self._parse_headers(header_data)
-                        headers_parsed = True
-
-                        content_length_header = self.response_headers.get("Content-Length")
-                        if content_length_header:
-                            try:
-                                content_length = int(content_length_header)
-                            except ValueError:
-                                logging.debug(f"Invalid Content-Length header: {content_length_header}")
-                        
-                        self.content_response = body_data.decode('utf-8', errors='ignore') # Assuming body is UTF-8
-                        
-                        if content_length is not None and len(body_data) >= content_length:
-                            break
-                        elif content_length is None:
-                            pass
-                    else:
-                        continue
+
+                if len(data) == read_size and read_size < READ_SIZE_MAX: # the stream had more waiting, read bigger next time
+                    read_size *= 2
+
+                if chunked_decoder:
+                    text_parts.append(text_decoder.decode(content_decoder.feed(chunked_decoder.feed(data))))
+                    reusable = chunked_decoder.done and not chunked_decoder.error
                 else:
-                    self.content_response += data.decode('utf-8', errors='ignore')
-                    if content_length is not None and len(self.content_response.encode('utf-8')) >= content_length:
-                        break
+                    body_received += len(data)
+                    text_parts.append(text_decoder.decode(content_decoder.feed(data)))
 
+                if document_stream:
+                    document_stream.feed(text_parts[-1])
+
+                if chunked_decoder and chunked_decoder.error:
+                    break
+
+            except TimeoutError:
+                raise
             except Exception as e:
                 logging.error(f"Error receiving messages: {e}")
                 break
 
-        self.socket.close()
-        self.socket = None
+        try:
+            text_parts.append(text_decoder.decode(content_decoder.flush(), final=True))
+        except zlib.error as e:
+            logging.error(f"Error decompressing response body: {e}")
 
-        if 300 <= int(self.response_status) < 400:
-            if self.redirect_count >= 4:
-                return
+        if self.response_headers.get("connection", "").casefold() == "close" or self.response_http_version == "HTTP/1.0":
+            reusable = False
 
-            location_header = self.response_headers["Location"]
-            if "http" in location_header or "https" in location_header:
-                self.get_request(location_header, self.request_headers)
-            else:
-                self.get_request(f"{self.scheme}://{self.host}{location_header}", self.request_headers)
-        else:
-            self.redirect_count = 0
+        await connection_pool.release(self.connection, reusable=reusable)
+        self.connection = None
 
-        if not css:
-            self.parse()
+        self.content_response = "".join(text_parts)
 
     def _parse_headers(self, header_data):
         lines = header_data.splitlines()
@@ -182,65 +399,226 @@ class HTTPClient():
                 break
             try:
                 header_name, value = line.split(":", 1)
-                headers[header_name.strip()] = value.strip()
+                headers[header_name.strip().casefold()] = value.strip()
             except ValueError:
                 logging.error(f"Error parsing header line: {line}")
         self.response_headers = headers
 
-    def parse(self):
-        self.css_rules = []
+    def load_html(self, content):
+        # for documents that didn't come from the network, like about: pages
+        self.cancel()
+        self.view_source = False
+        self.content_response = content
+        self.stylesheet_tasks = {}
+        self.document_stream = None
+        self.navigation = network_engine.submit(self.parse())
+        return self.navigation
+
+    def use_prefetched(self, client):
+        # takes over a page the prefetcher already loaded and parsed
+        self.cancel()
+        self.scheme, self.host, self.port, self.path = client.scheme, client.host, client.port, client.path
+        self.request_headers = client.request_headers
+        self.copy_response(client)
+        self.view_source = False
+        self.nodes = client.nodes
+        self.css_rules = client.css_rules
+        self.needs_render = True
 
-        html_cache_filename = f"{self.scheme}_{self.host}_{self.port}_{self.path.replace('/', '_')}.html"
+    def preload_stylesheet(self, css_link):
+        if css_link in self.stylesheet_tasks:
+            return
 
-        if html_cache_filename in os.listdir("html_cache"):
-            with open(f"html_cache/{html_cache_filename}", "r") as file:
-                self.content_response = file.read()
-        else:
-            with open(f"html_cache/{html_cache_filename}", "w") as file:
-                file.write(self.content_response)
+        url = resolve_url(self.scheme, self.host, self.port, self.path, css_link)
+        self.stylesheet_tasks[css_link] = asyncio.ensure_future(load_stylesheet(url, self.request_headers, self.tab, max(self.priority, PRIORITY_STYLESHEET)))
 
-        original_scheme = self.scheme
-        original_host = self.host
-        original_port = self.port
-        original_path = self.path
-        original_response = self.content_response
+    async def parse(self):
+        loop = asyncio.get_running_loop()
+        nodes = None
+
+        if self.document_stream is None or not self.document_stream.received: # not streamed, like cached responses, about: pages and error responses
+            nodes = await loop.run_in_executor(None, dom_cache.lookup, self.content_response)
+            if nodes is None:
+                self.document_stream = DocumentStream(self)
+                self.document_stream.feed(self.content_response)
+
+        store_dom = nodes is None
+        if store_dom:
+            nodes = await self.document_stream.close()
+
+        self.nodes = nodes
 
-        self.nodes = HTML(self.content_response).parse()
-        
         css_links = [
             node.attributes["href"]
-            for node in tree_to_list(self.nodes, [])
+            for node in walk(self.nodes)
             if isinstance(node, Element)
             and node.tag == "link"
-            and node.attributes.get("rel") == "stylesheet"
-            and "href" in node.attributes
+            and is_stylesheet_link(node.attributes)
         ]
 
         for css_link in css_links:
-            self.content_response = ""
-            
-            css_cache_filename = f"{self.scheme}_{self.host}_{self.port}_{self.path}_{css_link}.json".replace('/', '_').replace('@', '_').replace('/', '_').replace(';', '_').replace('&', '_').replace('?', '_').replace(':', '') # we need to include the other variables so for example /styles.css wouldnt be cached for all websites
+            self.preload_stylesheet(css_link) # anything the preload scanner missed
+
+        css_rules = []
+        for css_link in css_links: # wait in document order so the cascade order is kept
+            css_rules.extend(await self.stylesheet_tasks[css_link])
+
+        css_rules.extend(get_inline_styles(self.nodes))
+
+        self.css_rules = css_rules
+        self.needs_render = True
+
+        if store_dom: # after the page is handed over, so encoding doesn't delay the first render
+            await loop.run_in_executor(None, dom_cache.store, self.content_response, self.nodes)
+
+class DocumentStream():
+    # Gets the document text as it arrives: the preload scanner sees it right away, the tree is built off the event loop
+    # and painted early once there's something to show
+    def __init__(self, client):
+        self.client = client
+        self.preload_scanner = PreloadScanner(client.preload_stylesheet)
+        self.parser = HTML()
+        self.pending = []
+        self.parsing = None
+        self.received = False
+        self.painted_text_length = 0
+
+    def feed(self, text):
+        self.received = True
+        self.preload_scanner.feed(text)
+        self.pending.append(text)
+
+        if self.parsing is None or self.parsing.done():
+            self.parsing = asyncio.ensure_future(self.parse_pending())
+
+    async def parse_pending(self):
+        while self.pending:
+            text = "".join(self.pending)
+            self.pending.clear()
+
+            # tree building is CPU bound, keep it off the event loop so other tabs keep loading. Whatever a paint needs
+            # from the tree is collected there too, under the lock, so the loop never waits on the renderer
+            painted = await asyncio.get_running_loop().run_in_executor(None, self.feed_parser, text)
+            if painted:
+                self.paint(*painted)
+
+    def feed_parser(self, text):
+        with self.client.tree_lock:
+            self.parser.feed(text)
+
+            text_length = self.parser.body_text_length
+            if self.client.view_source or text_length < max(FIRST_PAINT_TEXT, self.painted_text_length * REPAINT_GROWTH):
+                return
+
+            return text_length, get_inline_styles(self.parser.root)
 
-            if css_cache_filename in os.listdir("css_cache"):
-                with open(f"css_cache/{css_cache_filename}", "r") as file:
-                    rules = CSSParser.from_json(ujson.load(file))
-            else:
-                self.get_request(resolve_url(self.scheme, self.host, self.port, self.path, css_link), self.request_headers, css=True)
-                while not self.content_response:
-                    time.sleep(0.025)
+    def close_parser(self):
+        with self.client.tree_lock:
+            return self.parser.close()
+
+    def paint(self, text_length, inline_styles):
+        # stylesheets found so far block painting, like in every other browser, otherwise the page would flash unstyled
+        if not all(task.done() and not task.cancelled() for task in self.client.stylesheet_tasks.values()):
+            return
+
+        css_rules = []
+        for task in self.client.stylesheet_tasks.values():
+            css_rules.extend(task.result())
+        css_rules.extend(inline_styles)
+
+        logging.debug(f"Painting partial document with {text_length} characters of text")
+        self.painted_text_length = text_length
+        self.client.nodes = self.parser.root
+        self.client.css_rules = css_rules
+        self.client.needs_render = True
+
+    async def close(self):
+        while self.parsing and not self.parsing.done():
+            await self.parsing
+
+        return await asyncio.get_running_loop().run_in_executor(None, self.close_parser)
+
+    def cancel(self):
+        if self.parsing:
+            self.parsing.cancel()
+
+class SharedExchange():
+    # One network exchange that several HTTPClients are waiting on, the body text is fanned out to every waiter's preload scanner
+    def __init__(self, client):
+        self.client = HTTPClient()
+        self.client.open_url(client.get_url(), client.request_headers)
+        self.client.document_stream = self
+        self.client.priority = client.priority
+        self.client.tab = client.tab
+
+        self.text_parts = []
+        self.streams = []
+        self.waiters = 0
+
+        self.task = asyncio.ensure_future(self.client.perform_exchange())
+
+    def feed(self, text):
+        self.text_parts.append(text)
+        for document_stream in self.streams:
+            document_stream.feed(text)
+
+    def add_stream(self, document_stream):
+        for text in self.text_parts: # catch up on what was already received
+            document_stream.feed(text)
+        self.streams.append(document_stream)
+
+    def remove_stream(self, document_stream):
+        if document_stream in self.streams:
+            self.streams.remove(document_stream)
+
+    def promote(self, client):
+        # the exchange runs at the priority of its most urgent waiter, a click on a link that is still being prefetched
+        # mustn't wait behind the prefetch limit
+        if client.priority >= self.client.priority:
+            return
 
-                rules = CSSParser(self.content_response).parse()
+        self.client.priority = client.priority
+        self.client.tab = client.tab
+        if self.client.scheduled_request is not None: # not yet when the HTTP cache is still being checked
+            self.client.scheduled_request = scheduler.promote(self.client.scheduled_request, client.priority, client.tab)
 
-                with open(f"css_cache/{css_cache_filename}", "w") as file:
-                    ujson.dump(CSSParser.to_json(rules), file)
+class ExchangeCoalescer():
+    def __init__(self):
+        self.inflight = {}
+
+        self.exchanges = 0
+        self.coalesced = 0
+
+    async def exchange(self, client):
+        key = (client.get_url(), tuple(sorted(client.request_headers.items())))
+
+        shared = self.inflight.get(key)
+        if shared is None:
+            self.exchanges += 1
+            shared = self.inflight[key] = SharedExchange(client)
+            shared.task.add_done_callback(lambda _: self.inflight.pop(key, None) if self.inflight.get(key) is shared else None)
+        else:
+            logging.debug(f"Coalescing request for {key[0]} with one already in flight")
+            self.coalesced += 1
+            shared.promote(client)
+
+        if client.document_stream:
+            shared.add_stream(client.document_stream)
+        shared.waiters += 1
+
+        try:
+            await asyncio.shield(shared.task)
+        except asyncio.CancelledError:
+            if client.document_stream:
+                shared.remove_stream(client.document_stream)
 
-            self.css_rules.extend(rules)
+            shared.waiters -= 1
+            if not shared.waiters and not shared.task.done(): # nobody wants it anymore
+                self.inflight.pop(key, None)
+                shared.task.cancel()
+            raise
 
-        self.css_rules.extend(get_inline_styles(self.nodes))
+        shared.waiters -= 1
+        client.copy_response(shared.client)
 
-        self.scheme = original_scheme
-        self.host = original_host
-        self.port = original_port
-        self.path = original_path
-        self.content_response = original_response
-        self.needs_render = True
\ No newline at end of file
+exchange_coalescer = ExchangeCoalescer()
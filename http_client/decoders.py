@@ -0,0 +1,131 @@
+import zlib, codecs, logging
+
+SUPPORTED_CONTENT_ENCODINGS = "gzip, deflate"
+DEFAULT_CHARSET = "utf-8"
+
+def get_charset(content_type):
+    for parameter in content_type.split(";")[1:]:
+        name, _, value = parameter.partition("=")
+        if name.strip().casefold() != "charset":
+            continue
+
+        charset = value.strip().strip("\"'")
+        try:
+            codecs.lookup(charset)
+            return charset
+        except LookupError:
+            logging.debug(f"Unknown charset {charset}, falling back to {DEFAULT_CHARSET}")
+
+    return DEFAULT_CHARSET
+
+def get_text_decoder(content_type):
+    # incremental so multi-byte sequences split across reads are decoded correctly
+    return codecs.getincrementaldecoder(get_charset(content_type))(errors="replace")
+
+class ChunkedDecoder():
+    def __init__(self):
+        self.buffer = bytearray()
+        self.state = "size"
+        self.remaining = 0
+        self.done = False
+        self.error = False # broken framing, whatever is left on the connection can't be trusted
+
+    def feed(self, data):
+        self.buffer += data
+        decoded = []
+
+        while not self.done:
+            if self.state == "size":
+                line_end = self.buffer.find(b"\r\n")
+                if line_end == -1:
+                    break
+
+                size_line = bytes(self.buffer[:line_end]).split(b";", 1)[0].strip() # chunk extensions are ignored
+                del self.buffer[:line_end + 2]
+
+                try:
+                    self.remaining = int(size_line, 16)
+                except ValueError:
+                    logging.error(f"Invalid chunk size line: {size_line}")
+                    self.done = True
+                    self.error = True
+                    break
+
+                self.state = "data" if self.remaining else "trailer"
+            elif self.state == "data":
+                if not self.buffer:
+                    break
+
+                piece = bytes(self.buffer[:self.remaining])
+                del self.buffer[:len(piece)]
+                decoded.append(piece)
+
+                self.remaining -= len(piece)
+                if not self.remaining:
+                    self.state = "data_end"
+            elif self.state == "data_end":
+                if len(self.buffer) < 2:
+                    break
+
+                del self.buffer[:2] # \r\n after every chunk
+                self.state = "size"
+            elif self.state == "trailer":
+                line_end = self.buffer.find(b"\r\n")
+                if line_end == -1:
+                    break
+
+                trailer_line = self.buffer[:line_end]
+                del self.buffer[:line_end + 2]
+
+                if not trailer_line: # empty line ends the trailer section
+                    self.done = True
+
+        return b"".join(decoded)
+
+class ContentDecoder():
+    def __init__(self, content_encoding):
+        self.encodings = []
+        self.decompressors = []
+
+        # Content-Encoding lists encodings in the order they were applied, so they have to be undone in reverse
+        for encoding in reversed(content_encoding.casefold().split(",")):
+            encoding = encoding.strip()
+            if encoding in ["gzip", "x-gzip", "deflate"]:
+                self.encodings.append(encoding)
+                self.decompressors.append(None) # created lazily once we see the first bytes
+            elif encoding and encoding != "identity":
+                logging.error(f"Unsupported Content-Encoding: {encoding}")
+
+    def create_decompressor(self, encoding, data):
+        if encoding != "deflate":
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        # "deflate" should be zlib-wrapped, but plenty of servers send a raw deflate stream instead
+        if len(data) >= 2 and data[0] & 0x0F == 8 and (data[0] * 256 + data[1]) % 31 == 0:
+            return zlib.decompressobj()
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+
+    def feed(self, data):
+        for index, encoding in enumerate(self.encodings):
+            if not data:
+                break
+
+            if self.decompressors[index] is None:
+                self.decompressors[index] = self.create_decompressor(encoding, data)
+
+            data = self.decompressors[index].decompress(data)
+
+        return data
+
+    def flush(self):
+        data = b""
+        for index, decompressor in enumerate(self.decompressors):
+            if decompressor is None:
+                if not data:
+                    continue
+                decompressor = self.decompressors[index] = self.create_decompressor(self.encodings[index], data)
+
+            if data:
+                data = decompressor.decompress(data)
+            data += decompressor.flush()
+        return data
@@ -0,0 +1,148 @@
+import struct, array, hashlib, logging, gc, sys
+
+from http_client.cache import cache_store
+from http_client.html_parser import Element, Text, EMPTY_ATTRIBUTES
+
+DOM_FORMAT_VERSION = 3 # part of the key, bump it when the format or the tree the parser builds changes
+MIN_CACHED_DOCUMENT = 16 * 1024 # smaller documents parse faster than they load
+
+# magic, name count, string count, string table length, node count, attribute count. Native byte order, the cache never leaves this machine
+HEADER = struct.Struct("=4sIIIII")
+MAGIC = b"DOM1"
+TEXT_NODE = -1 # in the attribute count column
+
+def encode_tree(root):
+    # Layout: header, string offsets (uint32), the utf-8 string table, then a flat preorder node array of
+    # (string, parent index, attribute count) int32 triples and the attributes as (name, value) uint32 pairs.
+    # Tag and attribute names come first in the string table so they can be interned on load.
+    names, values = {}, {}
+    node_array, attribute_array = array.array("i"), array.array("I")
+    text_nodes = [] # positions in node_array holding a value index, shifted past the names at the end
+    value_attributes = []
+
+    stack = [(root, -1)]
+    while stack:
+        node, parent = stack.pop()
+        if isinstance(node, Text):
+            text_nodes.append(len(node_array))
+            node_array.extend((values.setdefault(node.text, len(values)), parent, TEXT_NODE))
+            continue
+
+        index = len(node_array) // 3
+        node_array.extend((names.setdefault(node.tag, len(names)), parent, len(node.attributes)))
+        for name, value in node.attributes.items():
+            value_attributes.append(len(attribute_array) + 1)
+            attribute_array.extend((names.setdefault(name, len(names)), values.setdefault(value, len(values))))
+
+        stack.extend((child, index) for child in reversed(node.children))
+
+    for i in text_nodes:
+        node_array[i] += len(names)
+    for i in value_attributes:
+        attribute_array[i] += len(names)
+
+    strings = [*names, *values]
+    offsets = array.array("I", [0])
+    for string in strings:
+        offsets.append(offsets[-1] + len(string))
+
+    table = "".join(strings).encode("utf-8", "surrogatepass")
+
+    return b"".join([
+        HEADER.pack(MAGIC, len(names), len(strings), len(table), len(node_array) // 3, len(attribute_array) // 2),
+        offsets.tobytes(),
+        table,
+        node_array.tobytes(),
+        attribute_array.tobytes()
+    ])
+
+def decode_tree(data):
+    magic, name_count, string_count, table_length, node_count, attribute_count = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a cached DOM")
+
+    view = memoryview(data)
+    position = HEADER.size
+
+    # casts over the buffer, nothing is copied until the nodes are built
+    offsets = view[position:position + (string_count + 1) * 4].cast("I")
+    position += (string_count + 1) * 4
+    table = str(view[position:position + table_length], "utf-8", "surrogatepass")
+    position += table_length
+    node_array = view[position:position + node_count * 12].cast("i")
+    position += node_count * 12
+    attribute_array = view[position:position + attribute_count * 8].cast("I")
+
+    strings = [table[offsets[i]:offsets[i + 1]] for i in range(string_count)]
+    for i in range(name_count):
+        strings[i] = sys.intern(strings[i])
+
+    # preorder means every parent is built before its children, so they can be appended right away
+    nodes = []
+    attribute_values = attribute_array.tolist()
+    attribute_index = 0
+
+    for string, parent, attribute_count in zip(node_array[0::3], node_array[1::3], node_array[2::3]):
+        parent = nodes[parent] if parent >= 0 else None
+
+        if attribute_count == TEXT_NODE:
+            node = Text(strings[string], parent)
+        elif attribute_count:
+            end = attribute_index + attribute_count * 2
+            attributes = {strings[attribute_values[j]]: strings[attribute_values[j + 1]] for j in range(attribute_index, end, 2)}
+            attribute_index = end
+            node = Element(strings[string], attributes, parent)
+        else:
+            node = Element(strings[string], EMPTY_ATTRIBUTES, parent)
+
+        if parent is not None:
+            parent.children.append(node)
+        nodes.append(node)
+
+    return nodes[0] if nodes else None
+
+class DOMCache():
+    # Parsed documents keyed by a hash of their text, so a revisit builds the tree from flat arrays instead of parsing
+    def __init__(self, cache_store):
+        self.cache_store = cache_store
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, content):
+        return f"dom:{DOM_FORMAT_VERSION}:{hashlib.sha256(content.encode('utf-8', 'surrogatepass')).hexdigest()}"
+
+    def lookup(self, content):
+        if len(content) < MIN_CACHED_DOCUMENT:
+            return None
+
+        data = self.cache_store.get(self.get_key(content))
+        if data is None:
+            self.misses += 1
+            return None
+
+        # the tree is one big reference cycle, same as when parsing
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            tree = decode_tree(data)
+        except (ValueError, TypeError, IndexError, struct.error) as e:
+            logging.debug(f"Dropping unreadable cached DOM: {e}")
+            self.cache_store.delete(self.get_key(content))
+            return None
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+        self.hits += 1
+        return tree
+
+    def store(self, content, tree):
+        if len(content) < MIN_CACHED_DOCUMENT or tree is None:
+            return
+
+        key = self.get_key(content)
+        if not self.cache_store.contains(key): # the same text always parses to the same tree
+            self.cache_store.put(key, encode_tree(tree))
+
+dom_cache = DOMCache(cache_store)
@@ -0,0 +1,27 @@
+import asyncio, threading, logging
+
+class NetworkEngine():
+    # One event loop thread owns every socket, callers on other threads only ever get futures back
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True, name="network-engine")
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(log_future_exception)
+        return future
+
+def log_future_exception(future):
+    if future.cancelled():
+        return
+
+    exception = future.exception()
+    if exception:
+        logging.error(f"Unhandled network engine error: {exception!r}")
+
+network_engine = NetworkEngine()
@@ -1,12 +1,61 @@
-from utils.constants import SELF_CLOSING_TAGS, HEAD_TAGS, INHERITED_PROPERTIES
-import html.entities
+from utils.constants import SELF_CLOSING_TAGS, HEAD_TAGS, RAW_TEXT_TAGS, ESCAPABLE_RAW_TEXT_TAGS, P_CLOSING_TAGS, AUTO_CLOSED_SIBLINGS, INHERITED_PROPERTIES
+import html, html.entities, re, gc, sys, logging, hashlib, heapq
+
+from types import MappingProxyType
+
+attribute_pattern = re.compile(r"""([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+character_reference_pattern = re.compile(r"&(#[0-9]+;?|#[xX][0-9a-fA-F]+;?|[^\t\n\f <&#;]{1,32};?)") # the same references html.unescape finds
+tag_pattern = re.compile(r"""<[^>"']*(?:(?:"[^"]*"|'[^']*')[^>"']*)*>""") # a > inside a quoted attribute value doesn't end the tag
+tag_name_pattern = re.compile(r"/?[^\s/>]+")
+self_closing_tags = set(SELF_CLOSING_TAGS)
+head_tags = set(HEAD_TAGS)
+p_closing_tags = set(P_CLOSING_TAGS)
+raw_text_tags = set(RAW_TEXT_TAGS + ESCAPABLE_RAW_TEXT_TAGS)
+escapable_raw_text_tags = set(ESCAPABLE_RAW_TEXT_TAGS)
+raw_text_end_patterns = {tag: re.compile(rf"</{tag}\s*>", re.IGNORECASE) for tag in raw_text_tags}
+comment_end_pattern = re.compile("-->")
+# what the preload scanner looks for: <link> tags, and the starts of comments and raw text elements, whose content it skips
+preload_pattern = re.compile(rf"<!--|<({'|'.join(sorted(raw_text_tags))})\b[^>]*>|<link\b[^>]*>", re.IGNORECASE)
+
+EMPTY_ATTRIBUTES = MappingProxyType({}) # shared by every element without attributes, which is most of them
+
+def parse_attributes(text, start=0):
+    attributes = {}
+    for attribute in attribute_pattern.finditer(text, start):
+        name, *values = attribute.groups()
+        attributes[sys.intern(name.casefold())] = replace_attribute_symbols(next((value for value in values if value is not None), ""))
+    return attributes or EMPTY_ATTRIBUTES
+
+def is_stylesheet_link(attributes):
+    # rel is a case insensitive list of tokens, like rel="Stylesheet preload". Shared by the preload scanner and the parsed tree
+    return "stylesheet" in attributes.get("rel", "").casefold().split() and bool(attributes.get("href"))
+
+MAX_PRELOAD_PENDING = 4096
+MAX_END_MARKER = 32 # kept from a chunk that ends inside a comment or raw text, in case the end marker is split
+
+# insertion modes of the tree builder, the implicit html/head/body handling only happens before IN_BODY
+BEFORE_HTML, BEFORE_HEAD, IN_HEAD, AFTER_HEAD, IN_BODY = range(5)
+MODE_AFTER_OPEN = {"html": BEFORE_HEAD, "head": IN_HEAD, "body": IN_BODY}
+
+NO_CLASSES = frozenset()
+
 class Element:
+    __slots__ = ("tag", "attributes", "children", "parent", "style", "classes", "id")
+
     def __init__(self, tag, attributes, parent):
         self.tag = tag
         self.attributes = attributes
         self.children = []
         self.parent = parent
 
+        # split once here, selectors test them with a set lookup
+        if attributes:
+            self.classes = frozenset(attributes["class"].split()) if "class" in attributes else NO_CLASSES
+            self.id = attributes.get("id")
+        else:
+            self.classes = NO_CLASSES
+            self.id = None
+
     def __repr__(self):
         attrs = [" " + k + "=\"" + v + "\"" for k, v  in self.attributes.items()]
         attr_str = ""
@@ -15,148 +64,417 @@ class Element:
         return "<" + self.tag + attr_str + ">"
 
 class Text:
+    __slots__ = ("text", "parent", "style")
+    children = () # text never has children, so they all share one empty tuple
+
     def __init__(self, text, parent):
         self.text = text
-        self.children = []
         self.parent = parent
 
     def __repr__(self):
         return repr(self.text)
 
+class PreloadScanner():
+    # Looks ahead for <link rel=stylesheet> in raw HTML chunks, so stylesheet fetches can start before the tree is built
+    def __init__(self, on_stylesheet):
+        self.on_stylesheet = on_stylesheet
+        self.pending = ""
+        self.skip_until = None # the end pattern of the comment or raw text element the scan is inside, the parser never sees tags there
+
+    def feed(self, text):
+        text = self.pending + text
+        position = 0
+
+        while True:
+            if self.skip_until is not None:
+                match = self.skip_until.search(text, position)
+                if not match:
+                    self.pending = text[max(position, len(text) - MAX_END_MARKER):]
+                    return
+                position = match.end()
+                self.skip_until = None
+
+            match = preload_pattern.search(text, position)
+            if not match:
+                break
+            position = match.end()
+
+            if match.group(0) == "<!--":
+                self.skip_until = comment_end_pattern
+            elif match.group(1):
+                self.skip_until = raw_text_end_patterns[match.group(1).casefold()]
+            else:
+                attributes = parse_attributes(match.group(0), 5) # skip "<link"
+                if is_stylesheet_link(attributes):
+                    self.on_stylesheet(attributes["href"])
+
+        # keep an unterminated tag at the end around, its > might be in the next chunk
+        tag_start = text.rfind("<", position)
+        if tag_start != -1 and ">" not in text[tag_start:] and len(text) - tag_start < MAX_PRELOAD_PENDING:
+            self.pending = text[tag_start:]
+        else:
+            self.pending = ""
+
 class HTML():
-    def __init__(self, raw_html):
+    # Incremental: feed() text as it arrives and close() at the end, the tree under root is usable in between
+    def __init__(self, raw_html=""):
         self.raw_html = raw_html
         self.unfinished = []
-
-        self.parse()
+        self.root = None
+        self.buffer = "" # the end of the last chunk that couldn't be tokenized yet
+        self.text_parts = [] # text since the last tag, it might go on in the next chunk
+        self.raw_text_tag = None # set inside <script>, <style>, <textarea> and <title>
+        self.mode = BEFORE_HTML
+        self.open_counts = {} # tag -> how many of the unfinished elements have it, so end tags can be matched without a search
+        self.body_text_length = 0 # how much content the partial tree has, to decide when it's worth painting
     
     def parse(self):
-        text = ""
-        in_tag = False
-        for c in self.raw_html:
-            if c == "<":
-                in_tag = True
-                if (not self.unfinished or not self.unfinished[-1].tag == "style") and text: 
-                    self.add_text(text) # start of new tag means before everything was content/text
-                text = ""
-            elif c == ">":
-                in_tag = False
-                self.add_tag(text) # end of a tag means everything in-between were tags
-                text = ""
+        self.feed(self.raw_html)
+        return self.close()
+
+    def feed(self, raw_html):
+        # the tree is one big reference cycle, letting the garbage collector rescan it every few thousand nodes more than doubles parse time
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.tokenize(raw_html)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def tokenize(self, raw_html):
+        # splitting on < does the scanning in C, each piece is "tag>text". Comments, script/style content and quoted
+        # attribute values can contain < and > themselves, those are found with find and regexes and the pieces they cover skipped
+        buffer = self.buffer + raw_html
+        self.buffer = ""
+        text_parts = self.text_parts
+
+        resume = 0 # everything before this has been handled
+        if self.raw_text_tag:
+            resume = self.raw_text(buffer, 0)
+            if resume is None:
+                return
+
+        segments = buffer.split("<")
+        length = len(buffer)
+        position = len(segments[0]) # where the < of the next piece is
+
+        if resume < position:
+            text_parts.append(buffer[resume:position])
+
+        for index in range(1, len(segments)):
+            segment = segments[index]
+            tag_start = position
+            position += len(segment) + 1
+
+            if position <= resume:
+                continue
+            if tag_start < resume: # a comment or raw text ended inside this piece, the rest of it is text
+                text_parts.append(buffer[resume:min(position, length)])
+                continue
+
+            tag, found, text = segment.partition(">")
+            first = tag[:1]
+
+            if not (first.isalpha() or first in "/!?"): # like in "a < b"
+                text_parts.append("<")
+                text_parts.append(segment)
+                continue
+
+            if not found or (first == "!" and tag.startswith("!--") and not tag.endswith("--")) or ('"' in tag or "'" in tag) and (tag.count('"') % 2 or tag.count("'") % 2):
+                resume = self.slow_token(buffer, tag_start)
+                if resume is None:
+                    self.buffer = buffer[tag_start:]
+                    return
+                if resume < position:
+                    text_parts.append(buffer[resume:min(position, length)])
+                continue
+
+            if text_parts:
+                self.add_text(text_parts[0] if len(text_parts) == 1 else "".join(text_parts))
+                text_parts.clear()
+
+            if tag.isalnum(): # the common cases skip add_tag's attribute parsing
+                self.open_element(tag.casefold(), EMPTY_ATTRIBUTES)
+            elif first == "/" and tag[1:].isalnum():
+                self.close_element(tag[1:].casefold())
             else:
-                text += c
-        
-        if not in_tag and text:
-            self.add_text(text)
+                self.add_tag(tag)
+
+            if self.raw_text_tag:
+                resume = self.raw_text(buffer, tag_start + len(tag) + 2)
+                if resume is None:
+                    return
+                if resume < position:
+                    text_parts.append(buffer[resume:min(position, length)])
+            elif text:
+                text_parts.append(text)
+
+    def slow_token(self, buffer, tag_start):
+        # returns where the token ends, or None if it isn't complete yet
+        if buffer.startswith("<!--", tag_start):
+            comment_end = buffer.find("-->", tag_start + 4)
+            return comment_end + 3 if comment_end != -1 else None
+
+        match = tag_pattern.match(buffer, tag_start)
+        if not match:
+            return None
+
+        self.flush_text()
+        self.add_tag(buffer[tag_start + 1:match.end() - 1])
+
+        if self.raw_text_tag:
+            return self.raw_text(buffer, match.end())
+        return match.end()
+
+    def raw_text(self, buffer, start):
+        # the content of <script>, <style>, <textarea> and <title> is text until the matching end tag
+        match = raw_text_end_patterns[self.raw_text_tag].search(buffer, start)
+        if not match:
+            self.buffer = buffer[start:]
+            return None
+
+        if self.raw_text_tag in escapable_raw_text_tags:
+            self.add_text(buffer[start:match.start()])
+        else:
+            self.insert_text(buffer[start:match.start()]) # character references aren't decoded in script and style
+        self.close_element(self.raw_text_tag)
+        self.raw_text_tag = None
+        return match.end()
+
+    def close(self):
+        while not self.raw_text_tag and self.buffer.startswith("<") and ">" in self.buffer:
+            # an unterminated quote kept the tag open until the end, fall back to ending it at the first >
+            tag, rest = self.buffer[1:].split(">", 1)
+            self.buffer = ""
+            self.flush_text()
+            self.add_tag(tag)
+            self.feed(rest)
+
+        if self.buffer and (self.raw_text_tag or not self.buffer.startswith("<")): # an unfinished tag at the very end is dropped
+            self.text_parts.append(self.buffer)
+        self.buffer = ""
+        self.flush_text()
 
         return self.finish()
 
+    def flush_text(self):
+        if self.text_parts:
+            self.add_text("".join(self.text_parts))
+            self.text_parts.clear()
+
     def add_text(self, text):
-        if text.isspace(): return
-        self.implicit_tags(None)
+        self.insert_text(replace_symbols(text))
+
+    def insert_text(self, text):
+        if not text or text.isspace(): return
+        if self.mode != IN_BODY:
+            self.implicit_tags(None)
         parent = self.unfinished[-1]
         node = Text(text, parent)
         parent.children.append(node)
 
+        if self.mode == IN_BODY:
+            self.body_text_length += len(text)
+
     def get_attributes(self, text):
-        parts = text.split()
-        tag = parts[0].casefold()
-        attributes = {}
-        
-        for attrpair in parts[1:]:
-            if "=" in attrpair:
-                key, value = attrpair.split("=", 1)
-                if len(value) > 2 and value[0] in ["'", "\""]:
-                    value = value[1:-1]
-                attributes[key.casefold()] = value
-            else:
-                attributes[attrpair.casefold()] = ""
+        match = tag_name_pattern.match(text)
+        if not match:
+            return "", EMPTY_ATTRIBUTES
 
-        return tag, attributes
+        return match.group(0).casefold(), parse_attributes(text, match.end())
 
     def add_tag(self, tag):
         tag, attributes = self.get_attributes(tag)
         
-        if tag.startswith("!"): return
-        
-        self.implicit_tags(tag)
+        if not tag or tag[0] in "!?": return
 
-        if tag.startswith("/"):
-            if len(self.unfinished) == 1: return
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
-        elif tag in SELF_CLOSING_TAGS:
+        if tag[0] == "/":
+            self.close_element(tag[1:])
+        else:
+            self.open_element(tag, attributes)
+
+    def close_element(self, tag):
+        if self.mode != IN_BODY:
+            self.implicit_tags(f"/{tag}")
+
+        if tag in ["html", "body"] or not self.open_counts.get(tag): return # body and html stay open until finish(), stray end tags are dropped
+
+        # elements left open inside the one being closed end with it, like the <li> in <li>text</ul>
+        while self.pop_element().tag != tag:
+            pass
+
+    def pop_element(self):
+        node = self.unfinished.pop()
+        self.open_counts[node.tag] -= 1
+        if node.tag == "head":
+            self.mode = AFTER_HEAD
+        return node
+
+    def open_element(self, tag, attributes):
+        tag = sys.intern(tag) # every <p> then shares one tag string
+        if self.mode != IN_BODY:
+            self.implicit_tags(tag)
+        else:
+            if tag in MODE_AFTER_OPEN: return # a second html, head or body
+
+            current = self.unfinished[-1]
+            if current.tag == "p" and tag in p_closing_tags:
+                self.pop_element()
+                current = self.unfinished[-1]
+            if tag in AUTO_CLOSED_SIBLINGS and current.tag in AUTO_CLOSED_SIBLINGS[tag]:
+                self.pop_element()
+
+        if tag in self_closing_tags:
             parent = self.unfinished[-1]
             node = Element(tag, attributes, parent)
             parent.children.append(node)
         else:
             parent = self.unfinished[-1] if self.unfinished else None
             node = Element(tag, attributes, parent)
+            if parent:
+                parent.children.append(node) # attached right away so a partial tree can be painted
+            else:
+                self.root = node
             self.unfinished.append(node)
+            self.open_counts[tag] = self.open_counts.get(tag, 0) + 1
+
+            if tag in MODE_AFTER_OPEN:
+                self.mode = MODE_AFTER_OPEN[tag]
+            elif tag in raw_text_tags:
+                self.raw_text_tag = tag
 
     def implicit_tags(self, tag):
+        # only the current mode is looked at, so this is constant time however deep the tree is
         while True:
-            open_tags = [node.tag for node in self.unfinished]
-            if open_tags == [] and tag != "html":
-                self.add_tag("html")
-            elif open_tags == ["html"] and tag not in ["head", "body", "/html"]:
-                if tag in HEAD_TAGS:
-                    self.add_tag("head")
+            if self.mode == BEFORE_HTML and tag != "html":
+                self.open_element("html", EMPTY_ATTRIBUTES)
+            elif self.mode in (BEFORE_HEAD, AFTER_HEAD) and tag not in ["head", "body", "/html"]:
+                if tag in head_tags:
+                    self.open_element("head", EMPTY_ATTRIBUTES)
                 else:
-                    self.add_tag("body")
-            elif open_tags == ["html", "head"] and tag not in ["/head"] + HEAD_TAGS:
-                self.add_tag("/head")
+                    self.open_element("body", EMPTY_ATTRIBUTES)
+            elif self.mode == IN_HEAD and self.unfinished[-1].tag == "head" and tag != "/head" and tag not in head_tags:
+                self.close_element("head")
             else:
                 break
 
     def finish(self):
-        if not self.unfinished:
+        if not self.unfinished and not self.root:
             self.implicit_tags(None)
-    
-        while len(self.unfinished) > 1:
-            node = self.unfinished.pop()
-            parent = self.unfinished[-1]
-            parent.children.append(node)
-        return self.unfinished.pop()
+
+        self.unfinished.clear()
+        self.open_counts.clear()
+        return self.root
     
     @staticmethod
     def print_tree(node, indent=0):
-        print(" " * indent, node)
-        for child in node.children:
-            HTML.print_tree(child, indent + 2)
+        stack = [(node, indent)]
+        while stack:
+            node, indent = stack.pop()
+            print(" " * indent, node)
+            stack.extend((child, indent + 2) for child in reversed(node.children))
 
     @staticmethod
     def to_json(tree: Element | Text):
-        if isinstance(tree, Text):
-            return ["text", tree.text, [HTML.to_json(child) for child in tree.children]]
-        elif isinstance(tree, Element):
-            return ["element", tree.tag, tree.attributes, [HTML.to_json(child) for child in tree.children]]
+        root = []
+        stack = [(tree, root)] # node, the list its json goes into
+        while stack:
+            node, siblings = stack.pop()
+            children = []
+            if isinstance(node, Text):
+                siblings.append(["text", node.text, children])
+            elif isinstance(node, Element):
+                siblings.append(["element", node.tag, dict(node.attributes), children])
+            stack.extend((child, children) for child in reversed(node.children))
+        return root[0] if root else None
 
     @staticmethod
     def from_json(json_list, parent=None):
-        if json_list[0] == "text":
-            text = Text(json_list[1], parent)
-            text.children = [HTML.from_json(child, text) for child in json_list[2]]
-            return text
-        elif json_list[0] == "element":
-            element = Element(json_list[1], json_list[2], parent)
-            element.children = [HTML.from_json(child, element) for child in json_list[3]]
-            return element
+        root = None
+        stack = [(json_list, parent)]
+        while stack:
+            json_list, parent = stack.pop()
+            if json_list[0] == "text":
+                node = Text(json_list[1], parent)
+            elif json_list[0] == "element":
+                node = Element(json_list[1], json_list[2], parent)
+                stack.extend((child, node) for child in reversed(json_list[3]))
+            else:
+                continue
+
+            if root is None:
+                root = node
+            else:
+                parent.children.append(node)
+        return root
         
+# specificity packed into one int, so (ids, classes, tags) compare in that order as long as no selector has 1000 of one kind
+ID_SPECIFICITY = 1000 * 1000
+CLASS_SPECIFICITY = 1000
+TAG_SPECIFICITY = 1
+
+# Every selector has keys, the tags, ".class"es and "#id"s a matching node needs, and ancestor_keys, the ones it needs above it
 class TagSelector:
+    ancestor_keys = frozenset()
+
     def __init__(self, tag):
         self.tag = tag
-        self.priority = 1
+        self.keys = frozenset([tag])
+        self.priority = TAG_SPECIFICITY
     
     def matches(self, node):
         return isinstance(node, Element) and self.tag == node.tag
-    
+
+class UniversalSelector:
+    keys = frozenset()
+    ancestor_keys = frozenset()
+    priority = 0
+
+    def matches(self, node):
+        return isinstance(node, Element)
+
+class ClassSelector:
+    ancestor_keys = frozenset()
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = frozenset([f".{name}"])
+        self.priority = CLASS_SPECIFICITY
+
+    def matches(self, node):
+        return isinstance(node, Element) and self.name in node.classes
+
+class IdSelector:
+    ancestor_keys = frozenset()
+
+    def __init__(self, name):
+        self.name = name
+        self.keys = frozenset([f"#{name}"])
+        self.priority = ID_SPECIFICITY
+
+    def matches(self, node):
+        return isinstance(node, Element) and self.name == node.id
+
+class CompoundSelector:
+    # like a.external#top, every part has to match the same node
+    ancestor_keys = frozenset()
+
+    def __init__(self, selectors):
+        self.selectors = selectors
+        self.keys = frozenset().union(*(selector.keys for selector in selectors))
+        self.priority = sum(selector.priority for selector in selectors)
+
+    def matches(self, node):
+        return all(selector.matches(node) for selector in self.selectors)
+
 class DescendantSelector:
     def __init__(self, ancestor, descendant):
         self.ancestor = ancestor
         self.descendant = descendant
         self.priority = ancestor.priority + descendant.priority
+        self.keys = ancestor.keys | descendant.keys
+        self.ancestor_keys = ancestor.keys | descendant.ancestor_keys
 
     def matches(self, node):
         if not self.descendant.matches(node): return False
@@ -165,23 +483,135 @@ class DescendantSelector:
             node = node.parent
         return False
 
+class ChildSelector:
+    def __init__(self, parent, child):
+        self.parent = parent
+        self.child = child
+        self.priority = parent.priority + child.priority
+        self.keys = parent.keys | child.keys
+        self.ancestor_keys = parent.keys | child.ancestor_keys
+
+    def matches(self, node):
+        return self.child.matches(node) and node.parent is not None and self.parent.matches(node.parent)
+
+def get_element_keys(node):
+    # what an element offers to the selector keys above
+    if node.id is None and not node.classes:
+        return (node.tag,)
+
+    keys = [node.tag]
+    keys.extend(f".{name}" for name in node.classes)
+    if node.id is not None:
+        keys.append(f"#{node.id}")
+    return keys
+
+def pick_key(keys):
+    # the most selective key, an id, else a class, else the tag
+    keys = sorted(keys)
+    return next((key for key in keys if key[0] == "#"), None) or next((key for key in keys if key[0] == "."), None) or next(iter(keys), None)
+
+class RuleIndex():
+    # Buckets the rules by the most specific key their rightmost compound selector needs, then by the most specific key they need
+    # above it, so a node only tests the rules for its own tag, classes and id whose ancestor key is actually above it.
+    # Each bucket keeps the cascade order of the list it was built from, positions orders the rules of a node that fall into
+    # more than one bucket
+    def __init__(self, rules):
+        self.buckets = {} # key -> ancestor key (None if the rule needs nothing above) -> rules
+        for rule in rules:
+            key, ancestor_key = self.get_keys(rule[0])
+            self.buckets.setdefault(key, {}).setdefault(ancestor_key, []).append(rule)
+        self.positions = {id(rule): position for position, rule in enumerate(rules)}
+
+        self.checked = 0
+        self.rejected = 0
+
+    @staticmethod
+    def get_keys(selector):
+        ancestor_key = pick_key(selector.ancestor_keys)
+        while isinstance(selector, (DescendantSelector, ChildSelector)):
+            selector = selector.descendant if isinstance(selector, DescendantSelector) else selector.child
+
+        return pick_key(selector.keys) or "*", ancestor_key
+
+    def merge(self, rules, all_rules):
+        # rules already in cascade order, merged in after the ones here that have the same priority. Untouched buckets are
+        # shared, all_rules is the merged list
+        merged = RuleIndex(())
+        merged.buckets = dict(self.buckets)
+        for key, groups in RuleIndex(rules).buckets.items():
+            merged_groups = merged.buckets[key] = dict(self.buckets.get(key, {}))
+            for ancestor_key, bucket in groups.items():
+                merged_groups[ancestor_key] = list(heapq.merge(merged_groups.get(ancestor_key, ()), bucket, key=cascade_priority))
+        merged.positions = {id(rule): position for position, rule in enumerate(all_rules)}
+        return merged
+
+    @staticmethod
+    def add_buckets(buckets, groups, ancestor_counts):
+        if len(groups) <= len(ancestor_counts): # look up whichever side is smaller
+            buckets.extend(bucket for ancestor_key, bucket in groups.items() if ancestor_key is None or ancestor_key in ancestor_counts)
+        else:
+            if None in groups:
+                buckets.append(groups[None])
+            buckets.extend(groups[ancestor_key] for ancestor_key in ancestor_counts if ancestor_key in groups)
+
+    def candidates(self, node, ancestor_counts):
+        if not isinstance(node, Element):
+            return ()
+
+        buckets = []
+        for key in get_element_keys(node):
+            if key in self.buckets:
+                self.add_buckets(buckets, self.buckets[key], ancestor_counts)
+        if "*" in self.buckets:
+            self.add_buckets(buckets, self.buckets["*"], ancestor_counts)
+
+        rules = []
+        for bucket in buckets:
+            for rule in bucket:
+                if rule[0].ancestor_keys:
+                    # a rule needing a tag, class or id that isn't above the node is rejected before matches() walks the parents
+                    self.checked += 1
+                    if not ancestor_counts.keys() >= rule[0].ancestor_keys:
+                        self.rejected += 1
+                        continue
+                rules.append(rule)
+
+        if len(buckets) > 1:
+            positions = self.positions
+            rules.sort(key=lambda rule: positions[id(rule)])
+        return rules
+
 def cascade_priority(rule):
     selector, body = rule
     return selector.priority
 
-def get_inline_styles(node):
-    all_rules = []
+class CompiledStyleSheet():
+    # Rules in cascade order and the index style() matches with, built once and shared by every tab
+    def __init__(self, rules, rule_index=None):
+        self.rules = rules if rule_index else sorted(rules, key=cascade_priority)
+        self.rule_index = rule_index or RuleIndex(self.rules)
 
-    for node in node.children:
-        if isinstance(node, Element) and node.tag == "style":
-            if not node.children:
-                continue
+    def merge(self, rules):
+        # a page's own rules win over ours at the same priority, only the buckets they touch get rebuilt
+        rules = sorted(rules, key=cascade_priority)
+        all_rules = list(heapq.merge(self.rules, rules, key=cascade_priority))
+        return CompiledStyleSheet(all_rules, self.rule_index.merge(rules, all_rules))
 
-            if isinstance(node.children[0], Text):
-                all_rules.extend(CSSParser(node.children[0].text).parse()) # node's first children will just be a text element that contains the css
+compiled_style_sheets = {} # sha256 of the text -> CompiledStyleSheet
+
+def compile_style_sheet(text):
+    key = hashlib.sha256(text.encode()).hexdigest()
+    if key not in compiled_style_sheets:
+        compiled_style_sheets[key] = CompiledStyleSheet(CSSParser(text).parse())
+    return compiled_style_sheets[key]
+
+def get_inline_styles(tree):
+    all_rules = []
+
+    for node in walk(tree):
+        if isinstance(node, Element) and node.tag == "style" and node.children and isinstance(node.children[0], Text):
+            all_rules.extend(CSSParser(node.children[0].text).parse()) # node's first children will just be a text element that contains the css
 
-        all_rules.extend(get_inline_styles(node))
-    
     return all_rules
 
 class CSSParser:
@@ -250,23 +680,64 @@ class CSSParser:
 
         return pairs
     
+    def identifier(self):
+        start = self.i
+        while self.i < len(self.s) and (self.s[self.i].isalnum() or self.s[self.i] in "-_"):
+            self.i += 1
+        if not (self.i > start):
+            raise Exception("Parsing error")
+        return self.s[start:self.i]
+
+    def compound_selector(self):
+        selectors = []
+        if self.i < len(self.s) and self.s[self.i] == "*":
+            self.i += 1
+            selectors.append(UniversalSelector())
+        elif self.i < len(self.s) and self.s[self.i] not in ".#":
+            selectors.append(TagSelector(self.identifier().casefold()))
+
+        while self.i < len(self.s) and self.s[self.i] in ".#":
+            kind = self.s[self.i]
+            self.i += 1
+            name = self.identifier() # class names and ids are case sensitive
+            selectors.append(ClassSelector(name) if kind == "." else IdSelector(name))
+
+        if not selectors:
+            raise Exception("Parsing error")
+        return selectors[0] if len(selectors) == 1 else CompoundSelector(selectors)
+
     def selector(self):
-        out = TagSelector(self.word().casefold())
-        self.whitespace()
-        while self.i < len(self.s) and self.s[self.i] != "{":
-            tag = self.word()
-            descendant = TagSelector(tag.casefold())
-            out = DescendantSelector(out, descendant)
+        out = self.compound_selector()
+        while True:
+            had_whitespace = self.i < len(self.s) and self.s[self.i].isspace()
             self.whitespace()
-        return out
-        
+
+            if self.i >= len(self.s) or self.s[self.i] in "{,":
+                return out
+            elif self.s[self.i] == ">":
+                self.i += 1
+                self.whitespace()
+                out = ChildSelector(out, self.compound_selector())
+            elif had_whitespace:
+                out = DescendantSelector(out, self.compound_selector())
+            else: # pseudo classes, attribute selectors and such aren't supported, the rule is skipped
+                raise Exception("Parsing error")
+
+    def selector_list(self):
+        selectors = [self.selector()]
+        while self.i < len(self.s) and self.s[self.i] == ",":
+            self.i += 1
+            self.whitespace()
+            selectors.append(self.selector())
+        return selectors
+
     def parse(self):
         rules = []
         while self.i < len(self.s):
             try:
                 self.whitespace()
                 
-                selector = self.selector()
+                selectors = self.selector_list()
                 
                 self.literal("{")
                 
@@ -276,7 +747,7 @@ class CSSParser:
                 
                 self.literal("}")
 
-                rules.append((selector, body))
+                rules.extend((selector, body) for selector in selectors) # a, b { } is two rules, each with its own specificity
             except Exception:
                 why = self.ignore_until(["}"])
                 if why == "}":
@@ -290,8 +761,18 @@ class CSSParser:
     def convert_selector_to_json(self, selector):
         if isinstance(selector, TagSelector):
             return ["tag", selector.tag, selector.priority]
+        elif isinstance(selector, UniversalSelector):
+            return ["universal"]
+        elif isinstance(selector, ClassSelector):
+            return ["class", selector.name]
+        elif isinstance(selector, IdSelector):
+            return ["id", selector.name]
+        elif isinstance(selector, CompoundSelector):
+            return ["compound", [self.convert_selector_to_json(part) for part in selector.selectors]]
         elif isinstance(selector, DescendantSelector):
             return ["descendant", self.convert_selector_to_json(selector.ancestor), self.convert_selector_to_json(selector.descendant)]
+        elif isinstance(selector, ChildSelector):
+            return ["child", self.convert_selector_to_json(selector.parent), self.convert_selector_to_json(selector.child)]
         
     @classmethod
     def get_selector_from_json(self, selector_list):
@@ -299,57 +780,142 @@ class CSSParser:
             selector = TagSelector(selector_list[1])
             selector.priority = selector_list[2]
             return selector
+        elif selector_list[0] == "universal":
+            return UniversalSelector()
+        elif selector_list[0] == "class":
+            return ClassSelector(selector_list[1])
+        elif selector_list[0] == "id":
+            return IdSelector(selector_list[1])
+        elif selector_list[0] == "compound":
+            return CompoundSelector([self.get_selector_from_json(part) for part in selector_list[1]])
         elif selector_list[0] == "descendant":
             return DescendantSelector(self.get_selector_from_json(selector_list[1]), self.get_selector_from_json(selector_list[2]))
+        elif selector_list[0] == "child":
+            return ChildSelector(self.get_selector_from_json(selector_list[1]), self.get_selector_from_json(selector_list[2]))
 
     @classmethod
-    def to_json(self, rules_list: list[tuple[TagSelector | DescendantSelector, dict[str, str]]]):
+    def to_json(self, rules_list: list[tuple[TagSelector | UniversalSelector | ClassSelector | IdSelector | CompoundSelector | DescendantSelector | ChildSelector, dict[str, str]]]):
         return [[self.convert_selector_to_json(rule[0]), rule[1]] for rule in rules_list]
 
     @classmethod
     def from_json(self, rules_list):
         return [(self.get_selector_from_json(rule[0]), rule[1]) for rule in rules_list]
 
-def style(node, rules):
-    node.style = {}
+def style(tree, style_sheet):
+    # preorder, so what a node inherits is already computed. ancestor_counts holds the tags, classes and ids of the elements
+    # above the current node, they're added going down and removed coming back up
+    rule_index = style_sheet.rule_index
+    checked, rejected = rule_index.checked, rule_index.rejected # the index is shared, its counts are since it was built
+    computed_styles = {} # (id of the parent's style, ids of the matched rules, inline style) -> the style nodes like that share
+
+    style_node(tree, rule_index.candidates(tree, {}), computed_styles)
+    ancestor_counts = dict.fromkeys(get_element_keys(tree), 1)
+    parents = [get_element_keys(tree)] # the keys each open parent added
+    stack = [iter(tree.children)]
+
+    while stack:
+        for node in stack[-1]:
+            style_node(node, rule_index.candidates(node, ancestor_counts), computed_styles)
+            if node.children:
+                keys = get_element_keys(node)
+                for key in keys:
+                    ancestor_counts[key] = ancestor_counts.get(key, 0) + 1
+                parents.append(keys)
+                stack.append(iter(node.children))
+                break
+        else:
+            stack.pop()
+            for key in parents.pop():
+                ancestor_counts[key] -= 1
+                if not ancestor_counts[key]:
+                    del ancestor_counts[key]
+
+    checked, rejected = rule_index.checked - checked, rule_index.rejected - rejected
+    if checked:
+        logging.debug(f"Ancestor filter rejected {rejected} of {checked} ancestor-dependent selector candidates ({rejected / checked * 100:.1f}%)")
+    logging.debug(f"{len(computed_styles)} distinct computed styles")
+
+def style_node(node, rules, computed_styles):
+    # computed styles are read only and shared, every <li> in a list usually ends up with the same one
+    parent_style = node.parent.style if node.parent else None
+    matched_rules = [rule for rule in rules if rule[0].matches(node)] if rules else rules
+    inline_style = node.attributes.get("style") if isinstance(node, Element) else None
+
+    if not matched_rules and inline_style is None and parent_style is not None and len(parent_style) == len(INHERITED_PROPERTIES):
+        node.style = parent_style # it would be an exact copy of the parent's, so it's the same object until something differs
+        return
+
+    key = (id(parent_style), tuple(map(id, matched_rules)), inline_style) # parent styles live in computed_styles, so their ids stay unique
+    node.style = computed_styles.get(key)
+    if node.style is None:
+        node.style = computed_styles[key] = compute_style(parent_style, matched_rules, inline_style)
+
+def compute_style(parent_style, matched_rules, inline_style):
+    style = {}
 
     for property, default_value in INHERITED_PROPERTIES.items():
-        if node.parent:
-            node.style[property] = node.parent.style[property]
+        if parent_style is not None:
+            style[property] = parent_style[property]
         else:
-            node.style[property] = default_value
+            style[property] = default_value
 
-    for selector, body in rules:
-        if not selector.matches(node): continue
+    for selector, body in matched_rules:
         for property, value in body.items():
-            node.style[property] = value
+            style[property] = value
 
-    if isinstance(node, Element) and "style" in node.attributes:
-        pairs = CSSParser(node.attributes["style"]).body()
+    if inline_style is not None:
+        pairs = CSSParser(inline_style).body()
         for property, value in pairs.items():
-            node.style[property] = value 
+            style[property] = value
 
-    if node.style["font-size"].endswith("%"):
-        if node.parent:
-            parent_font_size = node.parent.style["font-size"]
+    if style["font-size"].endswith("%"):
+        if parent_style is not None:
+            parent_font_size = parent_style["font-size"]
         else:
             parent_font_size = INHERITED_PROPERTIES["font-size"]
 
-        node_pct = float(node.style["font-size"][:-1]) / 100
+        node_pct = float(style["font-size"][:-1]) / 100
         parent_px = float(parent_font_size[:-2])
-        node.style["font-size"] = str(node_pct * parent_px) + "px"
-
-    for child in node.children:
-        style(child, rules)
-
-def tree_to_list(tree, list):
-    list.append(tree)
-    for child in tree.children:
-        tree_to_list(child, list)
-    return list
+        style["font-size"] = str(node_pct * parent_px) + "px"
+
+    return MappingProxyType(style)
+
+def walk(tree):
+    # preorder, with an explicit stack of child iterators so a deeply nested document can't hit the recursion limit
+    yield tree
+    stack = [iter(tree.children)]
+    while stack:
+        for node in stack[-1]:
+            yield node
+            if node.children:
+                stack.append(iter(node.children))
+                break
+        else:
+            stack.pop()
 
 def replace_symbols(text):
-    for key, value in html.entities.html5.items():
-        text = text.replace(f"&{key};", value)
-
-    return text
\ No newline at end of file
+    # html.unescape is a single regex pass over named (longest legacy match without ;), decimal and hex references
+    if "&" not in text:
+        return text
+    return html.unescape(text)
+def replace_attribute_symbols(text):
+    # attribute values differ from text in one way: a legacy reference without ; followed by a letter, digit or = is left
+    # alone, so "?a=1&copy=2" stays a query string instead of becoming "?a=1©=2"
+    if "&" not in text:
+        return text
+    return character_reference_pattern.sub(replace_attribute_reference, text)
+
+def replace_attribute_reference(match):
+    reference = match.group(1)
+    if reference[0] == "#":
+        return html.unescape(match.group(0))
+
+    for length in range(len(reference), 1, -1): # the longest name wins, like in html.unescape
+        name = reference[:length]
+        if name in html.entities.html5:
+            following = reference[length:length + 1]
+            if name[-1] != ";" and (following == "=" or following.isascii() and following.isalnum()):
+                return match.group(0)
+            return html.entities.html5[name] + reference[length:]
+
+    return match.group(0)
\ No newline at end of file
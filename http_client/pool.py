@@ -0,0 +1,131 @@
+import asyncio, logging, time
+
+from http_client.resolver import connector
+from http_client.tls import tls_sessions
+
+MAX_CONNECTIONS_PER_HOST = 6
+IDLE_TIMEOUT = 30 # seconds a keep-alive connection may sit unused before we stop trusting it
+STREAM_LIMIT = 256 * 1024
+CONNECT_TIMEOUT = 10
+
+class PooledConnection():
+    def __init__(self, key, reader, writer):
+        self.key = key
+        self.reader = reader
+        self.writer = writer
+        self.last_used = time.monotonic()
+        self.reused = False
+
+    def is_idle_expired(self):
+        return time.monotonic() - self.last_used > IDLE_TIMEOUT
+
+    def is_stale(self):
+        # An idle keep-alive connection should have nothing to read, if the peer closed it we already got the EOF
+        return self.reader.at_eof() or self.writer.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+class ConnectionPool():
+    def __init__(self, max_per_host=MAX_CONNECTIONS_PER_HOST):
+        self.max_per_host = max_per_host
+        self.idle_connections = {}
+        self.active_counts = {}
+        self.condition = asyncio.Condition()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_closed = 0
+        self.idle_closed = 0
+
+    async def acquire(self, scheme, host, port):
+        key = (scheme, host, port)
+
+        async with self.condition:
+            while True:
+                idle = self.idle_connections.get(key, [])
+                while idle:
+                    connection = idle.pop()
+                    if connection.is_idle_expired():
+                        self.idle_closed += 1
+                        connection.close()
+                    elif connection.is_stale():
+                        logging.debug(f"Dropping stale connection to {host}:{port}")
+                        self.stale_closed += 1
+                        connection.close()
+                    else:
+                        self.hits += 1
+                        connection.reused = True
+                        self.active_counts[key] = self.active_counts.get(key, 0) + 1
+                        return connection
+
+                if self.active_counts.get(key, 0) < self.max_per_host:
+                    self.misses += 1
+                    self.active_counts[key] = self.active_counts.get(key, 0) + 1
+                    break
+
+                await self.condition.wait()
+
+        try:
+            reader, writer = await self.open_connection(scheme, host, port)
+        except BaseException:
+            async with self.condition:
+                self.active_counts[key] -= 1
+                self.condition.notify_all()
+            raise
+
+        return PooledConnection(key, reader, writer)
+
+    async def open_connection(self, scheme, host, port):
+        async with asyncio.timeout(CONNECT_TIMEOUT): # covers resolving, connecting and the TLS handshake
+            return await self.connect(scheme, host, port)
+
+    async def connect(self, scheme, host, port):
+        sock = await connector.connect(host, port)
+
+        if scheme != "https":
+            return await asyncio.open_connection(sock=sock, limit=STREAM_LIMIT)
+
+        try:
+            reader, writer = await asyncio.open_connection(sock=sock, ssl=tls_sessions.get_ssl_context(), server_hostname=host, limit=STREAM_LIMIT)
+        except BaseException:
+            sock.close()
+            raise
+
+        tls_sessions.record_handshake(writer.get_extra_info("ssl_object"))
+        return reader, writer
+
+    async def release(self, connection, reusable=True):
+        ssl_object = connection.writer.get_extra_info("ssl_object")
+        if ssl_object:
+            tls_sessions.remember(connection.key[1], ssl_object)
+
+        async with self.condition:
+            self.active_counts[connection.key] -= 1
+
+            if reusable:
+                connection.last_used = time.monotonic()
+                self.idle_connections.setdefault(connection.key, []).append(connection)
+            else:
+                connection.close()
+
+            self.condition.notify_all()
+
+    async def close_all(self):
+        async with self.condition:
+            for connections in self.idle_connections.values():
+                for connection in connections:
+                    connection.close()
+            self.idle_connections.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale_closed": self.stale_closed,
+            "idle_closed": self.idle_closed,
+            "idle_connections": sum(len(connections) for connections in self.idle_connections.values()),
+            "active_connections": sum(self.active_counts.values())
+        }
+
+connection_pool = ConnectionPool()
@@ -0,0 +1,127 @@
+import threading, logging, time
+
+from collections import OrderedDict
+
+from http_client.connection import HTTPClient
+from http_client.engine import network_engine
+from http_client.scheduler import PRIORITY_PREFETCH
+from http_client.html_parser import walk
+
+DEFAULT_PREFETCH_MEMORY = 64 * 1024 * 1024
+PREFETCH_TTL = 5 * 60 # a prefetched page nobody clicked on in this long is probably out of date
+MAX_VISIBLE_PREFETCHES = 8 # per view, hovered links are always prefetched
+
+# rough per object costs, the parsed tree is far bigger than the text it came from
+NODE_SIZE_ESTIMATE = 200
+RULE_SIZE_ESTIMATE = 300
+
+class PrefetchedPage():
+    def __init__(self, client, size):
+        self.client = client
+        self.size = size
+        self.prefetched_at = time.monotonic()
+
+    def is_expired(self):
+        return time.monotonic() - self.prefetched_at > PREFETCH_TTL
+
+class Prefetcher():
+    # Loads and parses pages the user is likely to open next, at prefetch priority so real loads always go first
+    def __init__(self, max_memory=DEFAULT_PREFETCH_MEMORY):
+        self.enabled = False
+        self.max_memory = max_memory
+        self.lock = threading.Lock()
+
+        self.pages = OrderedDict()
+        self.pending = {}
+        self.memory = 0
+
+        self.prefetched = 0
+        self.hits = 0
+        self.wasted = 0
+        self.wasted_bytes = 0
+
+    def configure(self, enabled, max_memory):
+        with self.lock:
+            self.enabled = enabled
+            self.max_memory = max_memory if enabled else 0
+
+            if not enabled:
+                for future in self.pending.values():
+                    future.cancel()
+                self.pending.clear()
+
+            self.evict()
+
+    def prefetch(self, url, request_headers):
+        with self.lock:
+            if not self.enabled or url in self.pages or url in self.pending:
+                return
+
+            self.pending[url] = network_engine.submit(self.load(url, request_headers))
+
+    async def load(self, url, request_headers):
+        client = HTTPClient()
+        client.priority = PRIORITY_PREFETCH
+        client.tab = self # all prefetches share one round robin turn
+
+        try:
+            await client.navigate(url, request_headers)
+        finally:
+            with self.lock:
+                self.pending.pop(url, None)
+
+        if client.nodes is None or not client.response_status or not 200 <= int(client.response_status) < 300:
+            return
+
+        client.needs_render = False
+        size = len(client.content_response) + sum(1 for _ in walk(client.nodes)) * NODE_SIZE_ESTIMATE + len(client.css_rules) * RULE_SIZE_ESTIMATE
+
+        with self.lock:
+            if not self.enabled:
+                return
+
+            self.pages[url] = PrefetchedPage(client, size)
+            self.memory += size
+            self.prefetched += 1
+            self.evict()
+
+    def take(self, url):
+        with self.lock:
+            page = self.pages.pop(url, None)
+            if page is None:
+                return None
+
+            self.memory -= page.size
+            if page.is_expired():
+                self.count_waste(page)
+                return None
+
+            logging.debug(f"Using prefetched page for {url}")
+            self.hits += 1
+            return page.client
+
+    def evict(self):
+        while self.pages and (self.memory > self.max_memory or next(iter(self.pages.values())).is_expired()):
+            _, page = self.pages.popitem(last=False)
+            self.memory -= page.size
+            self.count_waste(page)
+
+    def count_waste(self, page):
+        self.wasted += 1
+        self.wasted_bytes += page.size
+
+    def stats(self):
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "prefetched": self.prefetched,
+                "pending": len(self.pending),
+                "pages": len(self.pages),
+                "memory": self.memory,
+                "max_memory": self.max_memory,
+                "hits": self.hits,
+                "wasted": self.wasted,
+                "wasted_bytes": self.wasted_bytes
+            }
+
+prefetcher = Prefetcher()
@@ -1,17 +1,21 @@
 import arcade, pyglet, platform
 
-from utils.constants import BLOCK_ELEMENTS, token_pattern, emoji_pattern, INHERITED_PROPERTIES
+from utils.constants import BLOCK_ELEMENTS, HIDDEN_ELEMENTS, token_pattern, emoji_pattern, INHERITED_PROPERTIES
 from utils.utils import get_color_from_name, hex_to_rgb
+from utils.preload import DEFAULT_STYLE_SHEET
 
 from http_client.connection import HTTPClient
-from http_client.html_parser import CSSParser, Text, Element, style, cascade_priority
+from http_client.html_parser import Text, Element, style, walk
 
 from pyglet.font.base import Font as BaseFont
 
 from functools import lru_cache
 
+import bisect
+
 HSTEP = 13
 VSTEP = 18
+LINK_BAND_HEIGHT = 64 # hit testing only looks at the boxes in the band under the cursor
 
 SPACE_MULTIPLIER = 0.25 if not platform.system() == "Windows" else 0.33
 
@@ -62,9 +66,7 @@ class LineLayout:
         else:
             self.y = self.parent.y
 
-        for word in self.children:
-            word.layout()
-
+    def finish(self):
         if not self.children:
             self.height = 0
             return
@@ -115,6 +117,9 @@ class TextLayout():
 
         self.height = self.font.ascent + self.font.descent
 
+    def finish(self):
+        pass
+
 class BlockLayout:
     def __init__(self, node, parent, previous):
         self.node = node
@@ -159,6 +164,8 @@ class BlockLayout:
         if mode == "block":
             previous = None
             for child in self.node.children:
+                if isinstance(child, Element) and child.tag in HIDDEN_ELEMENTS:
+                    continue
                 next = BlockLayout(child, self, previous)
                 self.children.append(next)
                 previous = next
@@ -166,26 +173,26 @@ class BlockLayout:
             self.new_line()
             self.recurse(self.node)
 
-        for child in self.children:
-            child.layout()
-
+    def finish(self):
         self.height = sum([child.height for child in self.children])
 
     def recurse(self, node):
-        if isinstance(node, Text):
-            word_list = [match.group(0) for match in token_pattern.finditer(node.text)]
-
-            for word in word_list:
-                if emoji_pattern.fullmatch(word):
-                    self.word(self.node, word, emoji=True)
-                else:
-                    self.word(self.node, word)
-        else:
-            if node.tag == "br":
-                self.new_line()
-
-            for child in node.children:
-                self.recurse(child)
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, Text):
+                word_list = [match.group(0) for match in token_pattern.finditer(node.text)]
+
+                for word in word_list:
+                    if emoji_pattern.fullmatch(word):
+                        self.word(self.node, word, emoji=True)
+                    else:
+                        self.word(self.node, word)
+            elif node.tag not in HIDDEN_ELEMENTS:
+                if node.tag == "br":
+                    self.new_line()
+
+                stack.extend(reversed(node.children))
 
     def word(self, node, word: str, emoji=False):
         weight = node.style["font-weight"]
@@ -232,17 +239,84 @@ class DocumentLayout:
         self.width = arcade.get_window().width - 2 * HSTEP
         self.x = HSTEP
         self.y = VSTEP
-        child.layout()
-        self.height = child.height
+
+    def finish(self):
+        self.height = self.children[0].height
 
     def paint(self):
         return []
 
-def paint_tree(layout_object, display_list):
-    display_list.extend(layout_object.paint())
+def layout_tree(layout_object):
+    # layout() places a box and creates its children, finish() runs once they're all laid out. Siblings go in order
+    # since each one starts below the previous one. An explicit stack keeps deep documents clear of the recursion limit
+    stack = [(layout_object, False)]
+    while stack:
+        layout_object, children_done = stack.pop()
+        if children_done:
+            layout_object.finish()
+            continue
+
+        layout_object.layout()
+        stack.append((layout_object, True))
+        stack.extend((child, False) for child in reversed(layout_object.children))
 
-    for child in layout_object.children:
-        paint_tree(child, display_list)
+def paint_tree(layout_object, display_list):
+    for layout_object in walk(layout_object):
+        display_list.extend(layout_object.paint())
+
+class LinkIndex():
+    # Built once per layout, so hovering and scrolling don't have to walk the whole layout tree every time
+    def __init__(self, document):
+        self.bands = {} # band -> boxes overlapping it as (top, bottom, left, right, anchor), in document order
+        self.links = [] # (top, anchor) of every box inside a link, sorted by top
+
+        anchors = {} # DOM node -> the <a href> it's in, or None
+        for layout_object in walk(document):
+            if getattr(layout_object, "y", None) is None:
+                continue
+
+            top, bottom = layout_object.y, layout_object.y + layout_object.height
+            anchor = self.find_anchor(layout_object.node, anchors)
+            box = (top, bottom, layout_object.x, layout_object.x + layout_object.width, anchor)
+            for band in range(int(top // LINK_BAND_HEIGHT), int(bottom // LINK_BAND_HEIGHT) + 1):
+                self.bands.setdefault(band, []).append(box)
+
+            if anchor is not None:
+                self.links.append((top, anchor))
+
+        self.links.sort(key=lambda link: link[0])
+        self.link_tops = [top for top, anchor in self.links]
+
+    def find_anchor(self, node, anchors):
+        path = []
+        anchor = None
+        while node is not None:
+            if node in anchors:
+                anchor = anchors[node]
+                break
+
+            path.append(node)
+            if not isinstance(node, Text) and node.tag == "a" and "href" in node.attributes:
+                anchor = node
+                break
+
+            node = node.parent
+
+        for node in path:
+            anchors[node] = anchor
+
+        return anchor
+
+    def anchor_at(self, x, y):
+        # the innermost box under the point decides, like a walk keeping the last hit would
+        for top, bottom, left, right, anchor in reversed(self.bands.get(int(y // LINK_BAND_HEIGHT), ())):
+            if left <= x < right and top < y <= bottom:
+                return anchor
+
+    def anchors_between(self, top, bottom):
+        start = bisect.bisect_left(self.link_tops, top)
+        end = bisect.bisect_left(self.link_tops, bottom)
+        return [anchor for link_top, anchor in self.links[start:end]]
 
 class Renderer():
     def __init__(self, http_client: HTTPClient, window):
@@ -257,12 +331,22 @@ class Renderer():
         self.allow_scroll = False
         self.smallest_y = 0
         self.document = None
+        self.link_index = None # built on first use after each layout
+        self.painted_nodes = None
+        self.style_sheet = None # the browser's rules merged with the page's, rebuilt only when the page's change
+        self.style_sheet_rules = None
 
         self.widgets: list[pyglet.text.Label] = []
         self.text_to_create = []
 
         self.batch = pyglet.graphics.Batch()
 
+    def get_link_index(self):
+        if self.document and not self.link_index:
+            self.link_index = LinkIndex(self.document)
+
+        return self.link_index
+
     def hide_out_of_bounds_labels(self):
         for widget in self.widgets:
             invisible = (widget.y + (widget.content_height if not isinstance(widget, pyglet.shapes.Rectangle) else widget.height)) > self.window.height * 0.925
@@ -302,7 +386,7 @@ class Renderer():
                 multiline=multiline,
                 color=color,
                 x=x,
-                y=(self.window.height * 0.925) - y,
+                y=(self.window.height * 0.925) - y + self.scroll_y,
                 batch=self.batch
             )
         )
@@ -314,7 +398,7 @@ class Renderer():
         self.widgets.append(
             pyglet.shapes.Rectangle(
                 left,
-                (self.window.height * 0.925) - top - height,
+                (self.window.height * 0.925) - top - height + self.scroll_y,
                 width,
                 height,
                 color,
@@ -341,10 +425,20 @@ class Renderer():
         
         elif self.http_client.scheme == "http" or self.http_client.scheme == "https":
             if self.http_client.nodes:
-                style(self.http_client.nodes, sorted(self.http_client.css_rules + CSSParser(open("assets/css/browser.css").read()).parse(), key=cascade_priority))
+                if self.http_client.nodes is not self.painted_nodes: # a new page, a repaint of a loading one keeps the scroll position
+                    self.painted_nodes = self.http_client.nodes
+                    self.scroll_y = 0
+
+                if self.http_client.css_rules is not self.style_sheet_rules:
+                    self.style_sheet_rules = self.http_client.css_rules
+                    self.style_sheet = DEFAULT_STYLE_SHEET.merge(self.style_sheet_rules)
+
+                with self.http_client.tree_lock: # the tree may still be growing
+                    style(self.http_client.nodes, self.style_sheet)
 
-                self.document = DocumentLayout(self.http_client.nodes)
-                self.document.layout()
+                    self.document = DocumentLayout(self.http_client.nodes)
+                    layout_tree(self.document)
+                self.link_index = None
                 self.cmds = []
                 paint_tree(self.document, self.cmds)
                 
@@ -0,0 +1,161 @@
+import asyncio, socket, logging, time
+
+DNS_CACHE_TTL = 60 # getaddrinfo doesn't give us the record TTL, so every answer is kept for this long
+HAPPY_EYEBALLS_DELAY = 0.25 # RFC 8305 recommends 250ms between connection attempts
+
+class PendingLookup():
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+class DNSCache():
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self.pending = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.resolve_time = 0
+
+    async def resolve(self, host, port):
+        key = (host, port)
+
+        entry = self.entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        # one getaddrinfo per host, run as its own task so a waiter being cancelled doesn't cancel it for the others
+        lookup = self.pending.get(key)
+        if lookup is None:
+            self.misses += 1
+            lookup = self.pending[key] = PendingLookup(asyncio.ensure_future(self.lookup(key, host, port)))
+            lookup.task.add_done_callback(lambda _: self.pending.pop(key, None) if self.pending.get(key) is lookup else None)
+        else: # someone is already resolving this host, share their answer
+            self.hits += 1
+
+        lookup.waiters += 1
+        try:
+            return await asyncio.shield(lookup.task)
+        except asyncio.CancelledError:
+            if lookup.waiters == 1 and not lookup.task.done(): # nobody else wants the answer
+                self.pending.pop(key, None)
+                lookup.task.cancel()
+            raise
+        finally:
+            lookup.waiters -= 1
+
+    async def lookup(self, key, host, port):
+        start = time.perf_counter()
+        try:
+            address_infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        finally:
+            self.resolve_time += time.perf_counter() - start
+
+        self.entries[key] = (time.monotonic() + self.ttl, address_infos)
+        return address_infos
+
+    def clear(self):
+        self.entries.clear()
+
+def interleave_address_families(address_infos):
+    # RFC 8305 section 4, alternate between families starting with the one the resolver preferred
+    if not address_infos:
+        return []
+
+    first_family = address_infos[0][0]
+    preferred = [info for info in address_infos if info[0] == first_family]
+    others = [info for info in address_infos if info[0] != first_family]
+
+    interleaved = []
+    for index in range(max(len(preferred), len(others))):
+        interleaved.extend(infos[index] for infos in (preferred, others) if index < len(infos))
+    return interleaved
+
+async def connect_address(address_info):
+    family, type, proto, _, address = address_info
+
+    sock = socket.socket(family, type, proto)
+    sock.setblocking(False)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, address)
+    except BaseException:
+        sock.close()
+        raise
+
+    return sock
+
+class Connector():
+    def __init__(self, dns_cache, delay=HAPPY_EYEBALLS_DELAY):
+        self.dns_cache = dns_cache
+        self.delay = delay
+
+        self.connects = 0
+        self.connect_time = 0
+        self.family_wins = {socket.AF_INET: 0, socket.AF_INET6: 0}
+
+    async def connect(self, host, port):
+        address_infos = interleave_address_families(await self.dns_cache.resolve(host, port))
+
+        start = time.perf_counter()
+        sock = await self.race(address_infos)
+        self.connect_time += time.perf_counter() - start
+        self.connects += 1
+        self.family_wins[sock.family] = self.family_wins.get(sock.family, 0) + 1
+
+        return sock
+
+    async def race(self, address_infos):
+        # start one attempt, give it `delay` seconds (or until it fails) before starting the next one in parallel
+        attempts = set()
+        errors = []
+
+        try:
+            for address_info in address_infos:
+                attempts.add(asyncio.ensure_future(connect_address(address_info)))
+
+                sock = await self.wait_for_attempt(attempts, errors, self.delay)
+                if sock:
+                    return sock
+
+            while attempts:
+                sock = await self.wait_for_attempt(attempts, errors, None)
+                if sock:
+                    return sock
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+        raise OSError(f"Could not connect to any address: {errors}")
+
+    async def wait_for_attempt(self, attempts, errors, timeout):
+        done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        winner = None
+        for attempt in done:
+            attempts.discard(attempt)
+
+            if attempt.exception():
+                logging.debug(f"Connection attempt failed: {attempt.exception()}")
+                errors.append(attempt.exception())
+            elif winner is None:
+                winner = attempt.result()
+            else:
+                attempt.result().close() # lost the race by a hair
+
+        return winner
+
+    def stats(self):
+        return {
+            "dns_hits": self.dns_cache.hits,
+            "dns_misses": self.dns_cache.misses,
+            "resolve_time": self.dns_cache.resolve_time,
+            "connects": self.connects,
+            "connect_time": self.connect_time,
+            "ipv4_connects": self.family_wins[socket.AF_INET],
+            "ipv6_connects": self.family_wins[socket.AF_INET6]
+        }
+
+dns_cache = DNSCache()
+connector = Connector(dns_cache)
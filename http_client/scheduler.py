@@ -0,0 +1,165 @@
+import asyncio, time, contextlib
+
+from collections import namedtuple, deque, OrderedDict
+from types import MappingProxyType
+
+from http_client.pool import MAX_CONNECTIONS_PER_HOST
+
+PRIORITY_DOCUMENT = 0
+PRIORITY_STYLESHEET = 1
+PRIORITY_PREFETCH = 2
+PRIORITY_NAMES = ["document", "stylesheet", "prefetch"]
+
+MAX_ACTIVE_REQUESTS = 16
+FOREGROUND_RESERVED = 2 # slots only the foreground tab's document may take, so background work can never starve it
+MAX_ACTIVE_PREFETCHES = 4
+
+Request = namedtuple("Request", ["url", "headers", "priority", "tab"])
+Response = namedtuple("Response", ["url", "status", "explanation", "http_version", "headers", "content"])
+
+def make_request(url, headers, priority=PRIORITY_DOCUMENT, tab=None):
+    return Request(url, MappingProxyType(dict(headers)), priority, tab)
+
+def get_origin(url):
+    scheme, _, rest = url.partition("://")
+    host = rest.split("/", 1)[0]
+    if ":" not in host:
+        host = f"{host}:{443 if scheme == 'https' else 80}"
+    return f"{scheme}://{host}"
+
+class QueuedRequest():
+    def __init__(self, request):
+        self.request = request
+        self.origin = get_origin(request.url)
+        self.future = asyncio.get_running_loop().create_future()
+        self.queued_at = time.monotonic()
+
+class Scheduler():
+    # Decides which request goes out next: by priority, then the foreground tab, then round robin over the other tabs
+    def __init__(self, max_active=MAX_ACTIVE_REQUESTS, max_per_host=MAX_CONNECTIONS_PER_HOST):
+        self.max_active = max_active
+        self.max_per_host = max_per_host
+        self.foreground = None
+
+        self.queues = [OrderedDict() for _ in PRIORITY_NAMES] # tab -> deque of QueuedRequests, in round robin order
+        self.active = 0
+        self.active_per_host = {}
+        self.active_per_priority = [0 for _ in PRIORITY_NAMES]
+
+        self.started = [0 for _ in PRIORITY_NAMES]
+        self.cancelled = [0 for _ in PRIORITY_NAMES]
+        self.wait_time = [0 for _ in PRIORITY_NAMES]
+
+    def set_foreground(self, tab):
+        self.foreground = tab
+
+    @contextlib.asynccontextmanager
+    async def slot(self, request):
+        queued = QueuedRequest(request)
+        self.queues[request.priority].setdefault(request.tab, deque()).append(queued)
+        self.dispatch()
+
+        try:
+            await queued.future
+        except asyncio.CancelledError:
+            if queued.future.cancelled():
+                self.remove(queued) # dispatch may have dropped it already
+                self.cancelled[queued.request.priority] += 1
+            else: # got the slot and was cancelled before it could run
+                self.finish(queued)
+            raise
+
+        try:
+            yield
+        finally:
+            self.finish(queued)
+
+    def promote(self, request, priority, tab):
+        # a request that is still queued moves to a more urgent priority or to another tab, like a prefetch the user
+        # then clicks. One that already got its slot keeps it. Returns the request as it's queued now
+        tab_queue = self.queues[request.priority].get(request.tab, ())
+        queued = next((queued for queued in tab_queue if queued.request is request), None)
+        if queued is None:
+            return request
+
+        self.remove(queued)
+        queued.request = request._replace(priority=priority, tab=tab)
+        self.queues[priority].setdefault(tab, deque()).append(queued)
+        self.dispatch()
+        return queued.request
+
+    def remove(self, queued):
+        queue = self.queues[queued.request.priority]
+        tab_queue = queue.get(queued.request.tab)
+        if tab_queue is not None and queued in tab_queue:
+            tab_queue.remove(queued)
+            if not tab_queue:
+                del queue[queued.request.tab]
+
+    def finish(self, queued):
+        self.active -= 1
+        self.active_per_priority[queued.request.priority] -= 1
+        self.active_per_host[queued.origin] -= 1
+        if not self.active_per_host[queued.origin]:
+            del self.active_per_host[queued.origin]
+
+        self.dispatch()
+
+    def dispatch(self):
+        while self.active < self.max_active:
+            queued = self.next_request()
+            if queued is None:
+                return
+
+            self.remove(queued)
+            if queued.future.done(): # its waiter was cancelled in this loop turn and hasn't run its cleanup yet
+                continue
+
+            priority = queued.request.priority
+            self.active += 1
+            self.active_per_priority[priority] += 1
+            self.active_per_host[queued.origin] = self.active_per_host.get(queued.origin, 0) + 1
+            self.started[priority] += 1
+            self.wait_time[priority] += time.monotonic() - queued.queued_at
+
+            queued.future.set_result(None)
+
+    def next_request(self):
+        for priority, queue in enumerate(self.queues):
+            if priority == PRIORITY_PREFETCH and self.active_per_priority[priority] >= MAX_ACTIVE_PREFETCHES:
+                continue
+
+            tabs = list(queue)
+            if self.foreground in queue:
+                tabs.remove(self.foreground)
+                tabs.insert(0, self.foreground)
+
+            for tab in tabs:
+                if self.active >= self.max_active - FOREGROUND_RESERVED and not (tab is self.foreground and priority == PRIORITY_DOCUMENT):
+                    continue
+
+                for queued in queue[tab]: # oldest request of this tab whose host still has room
+                    if self.active_per_host.get(queued.origin, 0) < self.max_per_host:
+                        queue.move_to_end(tab) # this tab goes to the back of the round robin
+                        return queued
+
+        return None
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "max_active": self.max_active,
+            "active_hosts": dict(self.active_per_host),
+            "priorities": {
+                name: {
+                    "active": self.active_per_priority[priority],
+                    "queued": sum(len(tab_queue) for tab_queue in self.queues[priority].values()),
+                    "started": self.started[priority],
+                    "cancelled": self.cancelled[priority],
+                    "average_wait": self.wait_time[priority] / self.started[priority] if self.started[priority] else 0
+                }
+                for priority, name in enumerate(PRIORITY_NAMES)
+            }
+        }
+
+scheduler = Scheduler()
@@ -0,0 +1,63 @@
+import ssl, logging
+
+from collections import OrderedDict
+
+MAX_TLS_SESSIONS = 256
+
+class ResumingSSLContext(ssl.SSLContext):
+    # asyncio creates its SSLObjects through wrap_bio without a session argument, so we fill it in from the cache here
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side and server_hostname:
+            session = tls_sessions.get(server_hostname)
+
+        return super().wrap_bio(incoming, outgoing, server_side=server_side, server_hostname=server_hostname, session=session)
+
+class TLSSessionCache():
+    def __init__(self, max_sessions=MAX_TLS_SESSIONS):
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+        self.ssl_context = None
+
+        self.full_handshakes = 0
+        self.resumed_handshakes = 0
+
+    def get_ssl_context(self):
+        # loading the CA bundle is the slow part of create_default_context, so it only happens once per process
+        if self.ssl_context is None:
+            self.ssl_context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            self.ssl_context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+        return self.ssl_context
+
+    def get(self, host):
+        session = self.sessions.get(host)
+        if session is not None:
+            self.sessions.move_to_end(host)
+        return session
+
+    def record_handshake(self, ssl_object):
+        if ssl_object.session_reused:
+            self.resumed_handshakes += 1
+        else:
+            self.full_handshakes += 1
+
+    def remember(self, host, ssl_object):
+        # TLS 1.3 tickets arrive after the handshake, so this is called once the connection has been used
+        session = ssl_object.session
+        if session is None or not (session.has_ticket or session.id):
+            return
+
+        self.sessions[host] = session
+        self.sessions.move_to_end(host)
+
+        while len(self.sessions) > self.max_sessions:
+            expired_host, _ = self.sessions.popitem(last=False)
+            logging.debug(f"Dropping TLS session for {expired_host}")
+
+    def stats(self):
+        return {
+            "full_handshakes": self.full_handshakes,
+            "resumed_handshakes": self.resumed_handshakes,
+            "sessions": len(self.sessions)
+        }
+
+tls_sessions = TLSSessionCache()
@@ -3,8 +3,14 @@ import arcade, arcade.gui, asyncio, pypresence, time, copy, json, asyncio
 from utils.constants import discord_presence_id, DEFAULT_HEADERS
 from utils.utils import FakePyPresence
 
-from http_client.connection import HTTPClient, resolve_url
-from http_client.html_parser import tree_to_list, Text
+from http_client.connection import HTTPClient, resolve_url, exchange_coalescer
+from http_client.cache import http_cache, redirect_cache, cache_store
+from http_client.dom_cache import dom_cache
+from http_client.pool import connection_pool
+from http_client.scheduler import scheduler
+from http_client.prefetch import prefetcher, MAX_VISIBLE_PREFETCHES
+from http_client.resolver import connector
+from http_client.tls import tls_sessions
 from http_client.renderer import Renderer
 
 class Tab():
@@ -18,7 +24,12 @@ class Tab():
         self.request(url)
             
     def request(self, url):
-        if url.startswith("http://") or url.startswith("https://") or url.startswith("view-source:"):
+        self.http_client.cancel() # whatever this tab was loading before is no longer wanted
+
+        prefetched = prefetcher.take(url)
+        if prefetched:
+            self.http_client.use_prefetched(prefetched)
+        elif url.startswith("http://") or url.startswith("https://") or url.startswith("view-source:"):
             self.http_client.get_request(url, DEFAULT_HEADERS)
         elif url.startswith("file://"):
             self.http_client.file_request(url)
@@ -30,11 +41,53 @@ class Tab():
             self.http_client.scheme = "http"
         elif url == "about:config" or url == "about:settings":
             self.settings()
+        elif url == "about:cache":
+            self.about_cache()
+        elif url == "about:network":
+            self.about_network()
         else:
             self.http_client.get_request(f"https://{url}", DEFAULT_HEADERS)
 
         self.tab_button.text = url
 
+    def about_cache(self):
+        cache_stats = http_cache.stats()
+        pool_stats = connection_pool.stats()
+        connect_stats = connector.stats()
+        tls_stats = tls_sessions.stats()
+
+        hit_rate = (cache_stats["hits"] + cache_stats["revalidations"]) / cache_stats["lookups"] * 100 if cache_stats["lookups"] else 0
+
+        lines = [
+            f"Entries: {cache_stats['entries']}",
+            f"Size: {cache_stats['size'] / 1024 / 1024:.2f} MB of {cache_stats['max_size'] / 1024 / 1024:.0f} MB",
+            f"Hit rate: {hit_rate:.1f}% ({cache_stats['hits']} fresh, {cache_stats['revalidations']} revalidated, {cache_stats['lookups']} lookups)",
+            f"Bytes saved: {cache_stats['bytes_saved'] / 1024:.1f} KB",
+            f"Redirects served from cache: {redirect_cache.hits}",
+            f"Parsed documents served from cache: {dom_cache.hits} of {dom_cache.hits + dom_cache.misses}",
+            f"Evictions: {cache_stats['evictions']} ({cache_stats['evicted_bytes'] / 1024:.1f} KB)",
+            f"Connections reused: {pool_stats['hits']}, opened: {pool_stats['misses']}",
+            f"Requests coalesced: {exchange_coalescer.coalesced} of {exchange_coalescer.exchanges + exchange_coalescer.coalesced}",
+            f"DNS: {connect_stats['dns_hits']} cached, {connect_stats['dns_misses']} lookups, {connect_stats['resolve_time'] * 1000:.0f} ms resolving",
+            f"Connect: {connect_stats['connects']} connections ({connect_stats['ipv6_connects']} IPv6, {connect_stats['ipv4_connects']} IPv4), {connect_stats['connect_time'] * 1000:.0f} ms connecting",
+            f"TLS handshakes: {tls_stats['resumed_handshakes']} resumed, {tls_stats['full_handshakes']} full"
+        ]
+
+        self.http_client.scheme = "http"
+        self.http_client.load_html("<html><body><h1>Cache</h1>" + "".join(f"<p>{line}</p>" for line in lines) + "</body></html>")
+
+    def about_network(self):
+        scheduler_stats = scheduler.stats()
+
+        lines = [f"Active requests: {scheduler_stats['active']} of {scheduler_stats['max_active']}"]
+        for name, priority_stats in scheduler_stats["priorities"].items():
+            lines.append(f"{name.capitalize()}: {priority_stats['active']} active, {priority_stats['queued']} queued, {priority_stats['started']} started, {priority_stats['cancelled']} cancelled, {priority_stats['average_wait'] * 1000:.0f} ms average wait")
+        for origin, active in scheduler_stats["active_hosts"].items():
+            lines.append(f"{origin}: {active} active")
+
+        self.http_client.scheme = "http"
+        self.http_client.load_html("<html><body><h1>Network</h1>" + "".join(f"<p>{line}</p>" for line in lines) + "</body></html>")
+
     def settings(self):
         from menus.settings import Settings
         self.window.show_view(Settings(self.pypresence_client))
@@ -48,6 +101,9 @@ class Main(arcade.gui.UIView):
         with open("settings.json", "r") as file:
             self.settings_dict = json.load(file)
 
+        cache_store.configure(self.settings_dict.get("cache_size", 256) * 1024 * 1024, self.settings_dict.get("cache_compression", True))
+        prefetcher.configure(self.settings_dict.get("prefetch", False), self.settings_dict.get("prefetch_memory", 64) * 1024 * 1024)
+
         if self.settings_dict.get('discord_rpc', True):
             if self.pypresence_client == None: # Game has started
                 try:
@@ -83,6 +139,8 @@ class Main(arcade.gui.UIView):
         self.tabs: list[Tab] = []
         self.tab_buttons = []
         self.active_tab = None
+        self.hovered_link = None
+        self.prefetched_view = None
 
     def on_show_view(self):
         super().on_show_view()
@@ -115,6 +173,7 @@ class Main(arcade.gui.UIView):
             self.active_tab.tab_button.style = arcade.gui.UIFlatButton.DEFAULT_STYLE
 
         self.active_tab = tab
+        scheduler.set_foreground(tab.http_client) # the visible tab's document gets the reserved slots
         self.active_tab.tab_button.style = arcade.gui.UIFlatButton.STYLE_BLUE
 
         if self.active_tab.renderer.current_window_size != self.window.size:
@@ -148,32 +207,55 @@ class Main(arcade.gui.UIView):
     def on_update(self, delta_time):
         self.active_tab.renderer.update()
 
-    def on_mouse_press(self, x: int, y: int, button: int, modifiers: int):
-        if not self.active_tab.renderer.document:
+        view = (self.active_tab.renderer.document, self.active_tab.renderer.scroll_y)
+        if prefetcher.enabled and view != self.prefetched_view:
+            self.prefetched_view = view
+            self.prefetch_visible_links()
+
+    def resolve_link(self, anchor):
+        http_client = self.active_tab.http_client
+        return resolve_url(http_client.scheme, http_client.host, http_client.port, http_client.path, anchor.attributes["href"])
+
+    def get_link_at(self, x, y):
+        link_index = self.active_tab.renderer.get_link_index()
+        if not link_index:
             return
-        
-        y -= self.active_tab.renderer.scroll_y
-        
-        objs = [
-            obj for obj in tree_to_list(self.active_tab.renderer.document, [])
-            if obj.x <= x < obj.x + obj.width
-            and ((self.window.height * 0.925) - obj.y - obj.height) <= y < ((self.window.height * 0.925) - obj.y)
-        ]
 
-        if not objs:
+        anchor = link_index.anchor_at(x, (self.window.height * 0.925) - y + self.active_tab.renderer.scroll_y) # window to document coordinates
+        if anchor is not None:
+            return self.resolve_link(anchor)
+
+    def prefetch_visible_links(self):
+        renderer = self.active_tab.renderer
+        link_index = renderer.get_link_index()
+        if not link_index:
             return
-        
-        elt = objs[-1].node
 
-        while elt:
-            if isinstance(elt, Text):
-                pass
-            elif elt.tag == "a" and "href" in elt.attributes:
-                url = resolve_url(self.active_tab.http_client.scheme, self.active_tab.http_client.host, self.active_tab.http_client.port, self.active_tab.http_client.path, elt.attributes["href"])
-                self.new_tab(url)
-                return
+        links = []
+        for anchor in link_index.anchors_between(renderer.scroll_y, renderer.scroll_y + self.window.height * 0.925):
+            url = self.resolve_link(anchor)
+            if url.startswith("http") and url not in links:
+                links.append(url)
+                if len(links) >= MAX_VISIBLE_PREFETCHES:
+                    break
 
-            elt = elt.parent
+        for url in links:
+            prefetcher.prefetch(url, DEFAULT_HEADERS)
+
+    def on_mouse_motion(self, x, y, dx, dy):
+        if not prefetcher.enabled:
+            return
+
+        url = self.get_link_at(x, y)
+        if url != self.hovered_link:
+            self.hovered_link = url
+            if url and url.startswith("http"):
+                prefetcher.prefetch(url, DEFAULT_HEADERS)
+
+    def on_mouse_press(self, x: int, y: int, button: int, modifiers: int):
+        url = self.get_link_at(x, y)
+        if url:
+            self.new_tab(url)
 
     def on_draw(self):
         super().on_draw()
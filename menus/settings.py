@@ -6,6 +6,8 @@ from utils.constants import button_style, dropdown_style, slider_style, settings
 from utils.utils import FakePyPresence
 from utils.preload import button_texture, button_hovered_texture
 
+from http_client.prefetch import prefetcher
+
 from arcade.gui import UIBoxLayout, UIAnchorLayout
 
 class Settings(arcade.gui.UIView):
@@ -130,6 +132,9 @@ class Settings(arcade.gui.UIView):
                 self.sliders[setting] = slider
                 self.value_layout.add(slider)
 
+        if category == "Miscellaneous":
+            self.key_layout.add(arcade.gui.UILabel(text=self.prefetch_stats_text(), font_name="Roboto", font_size=16, text_color=arcade.color.BLACK, multiline=True, width=self.window.width / 2))
+
         self.apply_button = arcade.gui.UITextureButton(texture=button_texture, texture_hovered=button_hovered_texture, text='Apply', style=button_style, width=200, height=100)
         self.apply_button.on_click = lambda event: self.apply_settings()
         self.anchor.add(self.apply_button, anchor_x="right", anchor_y="bottom", align_x=-10, align_y=10)
@@ -235,6 +240,16 @@ class Settings(arcade.gui.UIView):
 
             self.slider_labels[setting].text = label_text
 
+    def prefetch_stats_text(self):
+        stats = prefetcher.stats()
+        used = stats["hits"] + stats["wasted"]
+        hit_rate = stats["hits"] / used * 100 if used else 0
+
+        return (
+            f"Prefetched pages: {stats['prefetched']} ({stats['pending']} loading, {stats['pages']} waiting, {stats['memory'] / 1024 / 1024:.1f} MB)\n"
+            f"Used: {stats['hits']}, wasted: {stats['wasted']} ({stats['wasted_bytes'] / 1024 / 1024:.1f} MB), hit rate: {hit_rate:.0f}%"
+        )
+
     def credits(self):
         if hasattr(self, 'apply_button'):
             self.anchor.remove(self.apply_button)
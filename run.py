@@ -24,11 +24,6 @@ sys.excepthook = on_exception
 if not log_dir in os.listdir():
     os.makedirs(log_dir)
 
-if not os.path.exists("html_cache"):
-    os.makedirs("html_cache")
-
-if not os.path.exists("css_cache"):
-    os.makedirs("css_cache")
 while len(os.listdir(log_dir)) >= 5:
     files = [(file, os.path.getctime(os.path.join(log_dir, file))) for file in os.listdir(log_dir)]
     oldest_file = sorted(files, key=lambda x: x[1])[0][0]
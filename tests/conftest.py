@@ -0,0 +1,13 @@
+import pytest
+
+from http_client.cache import cache_store
+
+@pytest.fixture(autouse=True)
+def cache_database(tmp_path):
+    # every test gets an empty cache store instead of the cache.db in the working directory
+    with cache_store.lock:
+        if cache_store.database is not None:
+            cache_store.database.close()
+        cache_store.database = None
+        cache_store.path = str(tmp_path / "cache.db")
+    yield
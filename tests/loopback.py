@@ -0,0 +1,78 @@
+import http.server, threading
+
+from http_client.engine import network_engine
+
+CHUNK_SIZE = 777 # odd on purpose, so chunks don't line up with anything
+
+def run(coroutine, timeout=10):
+    # everything in http_client runs on the network engine's loop
+    return network_engine.submit(coroutine).result(timeout)
+
+class LoopbackServer():
+    # Threaded HTTP/1.1 server on 127.0.0.1. routes maps a path to a function that gets the request handler and returns
+    # (status, headers, body), raw bytes to write as is, or None to close the connection without answering
+    def __init__(self, routes, ssl_context=None, host="127.0.0.1"):
+        self.routes = routes
+        self.host = host
+        self.scheme = "https" if ssl_context else "http"
+        self.hits = {}
+        self.connections = 0
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                server.connections += 1
+                self.requests_on_connection = 0
+
+            def do_GET(self):
+                self.requests_on_connection += 1
+                path = self.path.split("?", 1)[0]
+                server.hits[path] = server.hits.get(path, 0) + 1
+
+                response = server.routes[path](self)
+                if response is None:
+                    self.close_connection = True
+                    return
+                if isinstance(response, bytes):
+                    self.wfile.write(response)
+                    self.close_connection = True
+                    return
+
+                status, headers, body = response
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+
+                if headers.get("Transfer-Encoding") == "chunked":
+                    self.end_headers()
+                    for start in range(0, len(body), CHUNK_SIZE):
+                        chunk = body[start:start + CHUNK_SIZE]
+                        self.wfile.write(b"%x;ext=1\r\n%s\r\n" % (len(chunk), chunk))
+                    self.wfile.write(b"0\r\nX-Trailer: 1\r\n\r\n")
+                else:
+                    if "Content-Length" not in headers:
+                        self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+        self.httpd = http.server.ThreadingHTTPServer((host, 0), Handler)
+        self.httpd.daemon_threads = True
+        if ssl_context:
+            self.httpd.socket = ssl_context.wrap_socket(self.httpd.socket, server_side=True)
+        self.port = self.httpd.server_address[1]
+
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        return f"{self.scheme}://{self.host}:{self.port}{path}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
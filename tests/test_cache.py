@@ -0,0 +1,68 @@
+import os, pytest
+
+from http_client.connection import fetch
+from http_client.scheduler import make_request
+from http_client.cache import CacheStore, http_cache
+from utils.constants import DEFAULT_HEADERS
+
+from loopback import LoopbackServer, run
+
+BODY = b"<p>cached v1</p>"
+
+def get(server, path, **headers):
+    return run(fetch(make_request(server.url(path), {**DEFAULT_HEADERS, **headers})))
+
+def etag(request):
+    if request.headers.get("If-None-Match") == '"v1"':
+        return (304, {"ETag": '"v1"'}, b"")
+    return (200, {"ETag": '"v1"', "Cache-Control": "no-cache"}, BODY)
+
+@pytest.fixture
+def server():
+    server = LoopbackServer({
+        "/max-age": lambda request: (200, {"Cache-Control": "max-age=600"}, BODY),
+        "/no-store": lambda request: (200, {"Cache-Control": "max-age=600, no-store"}, BODY),
+        "/etag": etag,
+        "/vary": lambda request: (200, {"Cache-Control": "max-age=600", "Vary": "Accept-Language"}, request.headers["Accept-Language"].encode())
+    })
+    yield server
+    server.close()
+
+def test_fresh_response_is_served_from_the_cache(server):
+    hits = http_cache.hits
+    assert [get(server, "/max-age").content for _ in range(3)] == [BODY.decode()] * 3
+    assert server.hits["/max-age"] == 1
+    assert http_cache.hits - hits == 2
+
+def test_no_store_is_never_served_from_the_cache(server):
+    get(server, "/no-store")
+    get(server, "/no-store")
+    assert server.hits["/no-store"] == 2
+
+def test_stale_response_is_revalidated_with_its_etag(server):
+    revalidations = http_cache.revalidations
+    first, second = get(server, "/etag"), get(server, "/etag")
+
+    assert first.content == second.content == BODY.decode()
+    assert second.status == "200" # the cached response, not the 304
+    assert server.hits["/etag"] == 2
+    assert http_cache.revalidations - revalidations == 1
+
+def test_vary_keeps_responses_for_different_request_headers_apart(server):
+    assert get(server, "/vary", **{"Accept-Language": "en"}).content == "en"
+    assert get(server, "/vary", **{"Accept-Language": "en"}).content == "en"
+    assert get(server, "/vary", **{"Accept-Language": "hu"}).content == "hu"
+    assert server.hits["/vary"] == 2
+
+def test_store_evicts_least_recently_used_entries(tmp_path):
+    store = CacheStore(str(tmp_path / "evict.db"), max_size=2500, compress=False)
+    for key in ["a", "b", "c"]:
+        store.put(key, os.urandom(1000))
+        if key == "b":
+            store.get("a") # a is now more recently used than b
+
+    assert store.get("a") is not None
+    assert store.get("b") is None
+    assert store.get("c") is not None
+    assert store.stats()["evictions"] == 1
+    assert store.total_size <= 2500
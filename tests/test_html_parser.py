@@ -0,0 +1,55 @@
+import pytest, html
+
+from http_client.html_parser import HTML, PreloadScanner, Element, Text, walk
+
+def scan(document, chunk_size):
+    found = []
+    scanner = PreloadScanner(found.append)
+    for start in range(0, len(document), chunk_size):
+        scanner.feed(document[start:start + chunk_size])
+    return found
+
+def stylesheet_links(document):
+    tree = HTML(document).parse()
+    return [node.attributes["href"] for node in walk(tree) if isinstance(node, Element) and node.tag == "link"]
+
+HIDDEN_LINKS = """<html><head>
+<link rel="stylesheet" href="/a.css">
+<!-- <link rel="stylesheet" href="/comment.css"> -->
+<script>document.write('<link rel="stylesheet" href="/script.css">')</script>
+<style>/* <link rel="stylesheet" href="/style.css"> */</style>
+<title>x <link rel="stylesheet" href="/title.css"></title>
+<link REL="Stylesheet preload" href="/b.css">
+</head><body><textarea><link rel="stylesheet" href="/textarea.css"></TEXTAREA >
+<link rel=stylesheet href=/c.css><link rel="icon" href="/icon.png"></body></html>"""
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, len(HIDDEN_LINKS)])
+def test_preload_scanner_skips_comments_and_raw_text(chunk_size):
+    assert scan(HIDDEN_LINKS, chunk_size) == ["/a.css", "/b.css", "/c.css"]
+
+def test_preload_scanner_finds_what_the_parser_finds():
+    assert stylesheet_links(HIDDEN_LINKS) == ["/a.css", "/b.css", "/c.css", "/icon.png"]
+
+def test_textarea_and_title_are_text_with_character_references():
+    tree = HTML("<html><head><title>A &amp; <b>B</b></title></head><body><textarea>1 &lt; 2 <p>x</p></textarea></body></html>").parse()
+    texts = {node.parent.tag: node.text for node in walk(tree) if isinstance(node, Text)}
+    assert texts == {"title": "A & <b>B</b>", "textarea": "1 < 2 <p>x</p>"}
+
+def test_script_text_is_not_decoded():
+    tree = HTML("<script>if (a &lt; b && c) {}</script>").parse()
+    assert [node.text for node in walk(tree) if isinstance(node, Text)] == ["if (a &lt; b && c) {}"]
+
+@pytest.mark.parametrize("value, decoded", [
+    ("/s?q=1&region=eu&copy=2&amp=3", "/s?q=1&region=eu&copy=2&amp=3"), # legacy names followed by a letter, digit or = stay
+    ("&copy 2024 &amp; co", "© 2024 & co"),
+    ("&notit &notin; &ampfoo;", "&notit ∉ &ampfoo;"),
+    ("&#39;&#x41&hellip;&bogus;", "'A…&bogus;")
+])
+def test_attribute_character_references(value, decoded):
+    tree = HTML(f'<a title="{value}">{value}</a>').parse()
+    link = next(node for node in walk(tree) if isinstance(node, Element) and node.tag == "a")
+    assert link.attributes["title"] == decoded
+    assert link.children[0].text == html.unescape(value) # text keeps decoding them
+
+def test_attribute_references_in_preloaded_links():
+    assert scan('<link rel=stylesheet href="/s.css?a=1&copy=2&lang=en&amp;v=3">', 7) == ["/s.css?a=1&copy=2&lang=en&v=3"]
@@ -0,0 +1,138 @@
+import gzip, zlib, time, socket, threading, pytest
+
+from http_client.connection import fetch, HTTPClient
+from http_client.scheduler import make_request
+from http_client.pool import connection_pool
+from utils.constants import DEFAULT_HEADERS
+
+from loopback import LoopbackServer, run
+
+PAGE = ("<html><body>" + "<p>héllo ünïcode wörld</p>" * 2000 + "</body></html>").encode()
+
+def get(server, path, headers=DEFAULT_HEADERS):
+    return run(fetch(make_request(server.url(path), headers)))
+
+def idle_connections(server):
+    return len(connection_pool.idle_connections.get(("http", server.host, server.port), []))
+
+def raw_deflate(data):
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+@pytest.fixture
+def server():
+    server = LoopbackServer({
+        "/page": lambda request: (200, {"Content-Type": "text/html; charset=utf-8"}, PAGE),
+        "/retry": lambda request: None if request.requests_on_connection == 2 else (200, {}, PAGE),
+        "/close": close_after_response,
+        "/broken": lambda request: b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n5\r\n<p>hi\r\nZZ\r\ngarbage"
+    })
+    yield server
+    server.close()
+
+def close_after_response(request):
+    request.close_connection = True # without saying so in a Connection header
+    return (200, {}, PAGE)
+
+def test_keep_alive_reuses_the_connection(server):
+    for _ in range(3):
+        assert get(server, "/page").content == PAGE.decode()
+
+    assert server.connections == 1
+    assert idle_connections(server) == 1
+
+def test_dead_reused_connection_is_retried_on_a_new_one(server):
+    assert get(server, "/retry").content == PAGE.decode()
+    assert get(server, "/retry").content == PAGE.decode() # the pooled connection is dropped without an answer
+
+    assert server.connections == 2
+    assert server.hits["/retry"] == 3
+
+def test_connection_closed_while_idle_is_not_reused(server):
+    assert get(server, "/close").content == PAGE.decode()
+    time.sleep(0.1) # let the EOF arrive
+    assert get(server, "/close").content == PAGE.decode()
+
+    assert server.connections == 2
+
+@pytest.mark.parametrize("encoding, encode, chunked", [
+    (None, lambda data: data, True),
+    ("gzip", gzip.compress, False),
+    ("gzip", gzip.compress, True),
+    ("deflate", zlib.compress, False),
+    ("deflate", raw_deflate, True), # servers that send raw deflate instead of zlib
+    ("gzip, deflate", lambda data: zlib.compress(gzip.compress(data)), True)
+])
+def test_chunked_and_compressed_bodies(encoding, encode, chunked):
+    headers = {"Content-Type": "text/html; charset=utf-8"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if chunked:
+        headers["Transfer-Encoding"] = "chunked"
+
+    server = LoopbackServer({"/page": lambda request: (200, headers, encode(PAGE))})
+    try:
+        response = get(server, "/page")
+        assert response.status == "200"
+        assert response.content == PAGE.decode()
+        assert idle_connections(server) == 1 # the body was framed correctly, so the connection is kept
+    finally:
+        server.close()
+
+def test_broken_chunked_framing_is_not_pooled(server):
+    assert get(server, "/broken").content == "<p>hi"
+    assert idle_connections(server) == 0
+
+def test_failed_retry_releases_the_connection_once():
+    # the server answers once, then drops the kept-alive connection and stops listening, so the retry can't connect
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+
+    def serve():
+        connection, _ = listener.accept()
+        reader = connection.makefile("rb")
+        for request in range(2):
+            while reader.readline() not in (b"\r\n", b""):
+                pass
+            if request == 0:
+                connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+        listener.close()
+        connection.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+
+    url = f"http://127.0.0.1:{port}/"
+    assert run(fetch(make_request(url, DEFAULT_HEADERS))).content == "ok"
+    with pytest.raises(OSError):
+        run(fetch(make_request(url, DEFAULT_HEADERS)))
+    thread.join(5)
+
+    assert connection_pool.active_counts[("http", "127.0.0.1", port)] == 0
+
+class RecordingLock():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.threads = set()
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.threads.add(threading.current_thread().name)
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+def test_streamed_document_never_takes_the_tree_lock_on_the_loop():
+    page = "<html><head><style>p { color: red }</style></head><body>" + "<p>a paragraph with some words in it</p>" * 2000 + "</body></html>"
+    server = LoopbackServer({"/": lambda request: (200, {"Content-Type": "text/html", "Transfer-Encoding": "chunked"}, page.encode())})
+    try:
+        client = HTTPClient()
+        client.tree_lock = RecordingLock() # the renderer holds it for all of style and layout
+        client.get_request(server.url("/"), DEFAULT_HEADERS).result(10)
+    finally:
+        server.close()
+
+    assert client.needs_render and client.css_rules
+    assert client.tree_lock.threads and "network-engine" not in client.tree_lock.threads
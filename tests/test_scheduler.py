@@ -0,0 +1,51 @@
+import asyncio
+
+from http_client.scheduler import Scheduler, make_request, PRIORITY_DOCUMENT, PRIORITY_PREFETCH
+
+async def hold_slot(scheduler, url, release=None, priority=PRIORITY_DOCUMENT, tab="tab"):
+    async with scheduler.slot(make_request(url, {}, priority, tab)):
+        if release:
+            await release.wait()
+
+def test_cancelled_waiter_is_skipped_while_dispatching():
+    async def scenario():
+        scheduler = Scheduler(max_active=3) # FOREGROUND_RESERVED leaves a background tab one slot
+        release = asyncio.Event()
+
+        first = asyncio.ensure_future(hold_slot(scheduler, "http://a/", release))
+        waiting = asyncio.ensure_future(hold_slot(scheduler, "http://b/"))
+        await asyncio.sleep(0)
+        assert scheduler.active == 1
+
+        # the first request finishes in the same loop turn the queued one is cancelled in
+        release.set()
+        waiting.cancel()
+        await asyncio.gather(first, waiting, return_exceptions=True)
+        assert first.exception() is None
+        assert waiting.cancelled()
+        assert scheduler.active == 0
+
+        await asyncio.wait_for(hold_slot(scheduler, "http://c/"), 1) # later requests still get a slot
+        assert scheduler.active == 0
+        assert scheduler.stats()["priorities"]["document"]["cancelled"] == 1
+
+    asyncio.run(scenario())
+
+def test_promoted_prefetch_skips_the_prefetch_limit():
+    async def scenario():
+        scheduler = Scheduler()
+        release = asyncio.Event()
+
+        prefetches = [asyncio.ensure_future(hold_slot(scheduler, f"http://p{i}/", release, PRIORITY_PREFETCH)) for i in range(5)]
+        await asyncio.sleep(0)
+        assert scheduler.active == 4 # MAX_ACTIVE_PREFETCHES, the fifth is queued
+
+        queued = next(iter(scheduler.queues[PRIORITY_PREFETCH].values()))[0]
+        scheduler.promote(queued.request, PRIORITY_DOCUMENT, "tab")
+        assert scheduler.active == 5
+
+        release.set()
+        await asyncio.gather(*prefetches)
+        assert scheduler.active == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,47 @@
+import ssl, shutil, subprocess, pytest
+
+from http_client.connection import fetch
+from http_client.scheduler import make_request
+from http_client.pool import connection_pool
+from http_client.tls import tls_sessions
+from utils.constants import DEFAULT_HEADERS
+
+from loopback import LoopbackServer, run
+
+pytestmark = pytest.mark.skipif(shutil.which("openssl") is None, reason="needs openssl to make a test CA")
+
+def openssl(*args, cwd):
+    subprocess.run(["openssl", *args], cwd=cwd, check=True, capture_output=True)
+
+@pytest.fixture(scope="module")
+def certificates(tmp_path_factory):
+    # a self-signed CA and a localhost certificate signed by it
+    directory = tmp_path_factory.mktemp("tls")
+    (directory / "extensions.cnf").write_text("subjectAltName=DNS:localhost\n")
+    openssl("req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", "ca.key", "-out", "ca.pem", "-days", "1", "-subj", "/CN=Test CA", cwd=directory)
+    openssl("req", "-newkey", "rsa:2048", "-nodes", "-keyout", "server.key", "-out", "server.csr", "-subj", "/CN=localhost", cwd=directory)
+    openssl("x509", "-req", "-in", "server.csr", "-CA", "ca.pem", "-CAkey", "ca.key", "-CAcreateserial", "-out", "server.pem", "-days", "1", "-extfile", "extensions.cnf", cwd=directory)
+    return directory
+
+@pytest.fixture
+def server(certificates):
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(certificates / "server.pem", certificates / "server.key")
+    tls_sessions.get_ssl_context().load_verify_locations(certificates / "ca.pem")
+
+    server = LoopbackServer({"/": lambda request: (200, {}, b"<p>tls</p>")}, ssl_context=server_context, host="localhost")
+    yield server
+    server.close()
+
+def test_later_handshakes_resume_the_session(server):
+    before = tls_sessions.stats()
+    for _ in range(4):
+        assert run(fetch(make_request(server.url("/"), DEFAULT_HEADERS))).content == "<p>tls</p>"
+        run(connection_pool.close_all()) # the next request needs a new connection and so a new handshake
+
+    after = tls_sessions.stats()
+    assert after["full_handshakes"] - before["full_handshakes"] == 1
+    assert after["resumed_handshakes"] - before["resumed_handshakes"] == 3
+
+def test_context_is_created_once():
+    assert tls_sessions.get_ssl_context() is tls_sessions.get_ssl_context()
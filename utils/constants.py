@@ -46,6 +46,27 @@ SELF_CLOSING_TAGS = [
     "link", "meta", "param", "source", "track", "wbr",
 ]
 
+RAW_TEXT_TAGS = ["script", "style"] # their content is text until the matching end tag, never markup
+ESCAPABLE_RAW_TEXT_TAGS = ["textarea", "title"] # the same, but character references in them are decoded
+
+HIDDEN_ELEMENTS = ["head", "script", "style"]
+
+# opening one of these while a <p> is the current element closes the <p> first
+P_CLOSING_TAGS = [
+    "address", "article", "aside", "blockquote", "details", "div",
+    "dl", "fieldset", "figcaption", "figure", "footer", "form",
+    "h1", "h2", "h3", "h4", "h5", "h6", "header", "hgroup", "hr",
+    "li", "dd", "dt", "main", "menu", "nav", "ol", "p", "pre",
+    "section", "table", "ul",
+]
+
+# elements that end an open sibling of the listed kinds, like <li>1<li>2
+AUTO_CLOSED_SIBLINGS = {
+    "li": ["li"],
+    "dt": ["dt", "dd"],
+    "dd": ["dt", "dd"],
+}
+
 HEAD_TAGS = [
     "base", "basefont", "bgsound", "noscript",
     "link", "meta", "title", "style", "script",
@@ -99,6 +120,10 @@ settings = {
     },
     "Miscellaneous": {
         "Discord RPC": {"type": "bool", "config_key": "discord_rpc", "default": True},
+        "Cache Size (MB)": {"type": "slider", "min": 16, "max": 2048, "config_key": "cache_size", "default": 256},
+        "Cache Compression": {"type": "bool", "config_key": "cache_compression", "default": True},
+        "Speculative Prefetch": {"type": "bool", "config_key": "prefetch", "default": False},
+        "Prefetch Memory (MB)": {"type": "slider", "min": 8, "max": 512, "config_key": "prefetch_memory", "default": 64},
     },
     "Credits": {}
 }
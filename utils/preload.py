@@ -1,5 +1,5 @@
 import arcade.gui, arcade, os
-from http_client.html_parser import CSSParser
+from http_client.html_parser import compile_style_sheet
 
 # Get the directory where this module is located
 _module_dir = os.path.dirname(os.path.abspath(__file__))
@@ -8,4 +8,4 @@ _assets_dir = os.path.join(os.path.dirname(_module_dir), 'assets')
 button_texture = arcade.gui.NinePatchTexture(64 // 4, 64 // 4, 64 // 4, 64 // 4, arcade.load_texture(os.path.join(_assets_dir, 'graphics', 'button.png')))
 button_hovered_texture = arcade.gui.NinePatchTexture(64 // 4, 64 // 4, 64 // 4, 64 // 4, arcade.load_texture(os.path.join(_assets_dir, 'graphics', 'button_hovered.png')))
 
-DEFAULT_STYLE_SHEET = CSSParser(open(os.path.join(_assets_dir, "css", "browser.css")).read()).parse()
+DEFAULT_STYLE_SHEET = compile_style_sheet(open(os.path.join(_assets_dir, "css", "browser.css")).read())